@@ -0,0 +1,371 @@
+"""Benchmarks the card generation with synthetic Jira xml exports. Every stage (xml parsing,
+entry extraction, sanitizing, drawing and saving the pdf) is timed separately and the
+results are printed as JSON, so runs of different versions can be compared.
+
+With --startup, the start up time of short command line runs is measured instead. With
+--pipeline, whole runs from the xml file to the pdf are timed with and without pipelining.
+
+Example: python benchmark.py --items 100 10000 --links 2 --output results.json"""
+import argparse
+import gc
+import html
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as elementTree
+from typing import Iterable, Iterator
+
+import card_generator
+import markup_validator
+import pipeline
+import xml_parser
+
+DEFAULT_ITEM_COUNTS = [100, 10000, 100000]
+WORDS = ["backlog", "customer", "document", "export", "login", "report", "sprint", "team",
+         "audit", "search", "upload", "invoice", "dashboard", "release", "storage", "api"]
+PRIORITIES = ["Highest", "High", "Medium", "Low", "Lowest"]
+STAGES = ["parse", "entries", "sanitize", "render", "save"]
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+STARTUP_EXAMPLE = os.path.join(PROJECT_DIRECTORY, "examples", "Example with LexoRank.xml")
+# the last two commands show the cost of python itself and of the imports needed for rendering
+STARTUP_COMMANDS = {"help": ["xml_parser.py", "--help"],
+                    "dryRun": ["xml_parser.py", "--dry-run", STARTUP_EXAMPLE],
+                    "importParser": ["-c", "import xml_parser"],
+                    "python": ["-c", "pass"],
+                    "importRenderer": ["-c", "import card_generator"]}
+
+
+def create_description(rng: random.Random, length: int, links: float) -> str:
+    """Create a html description of about the given length containing links and new lines."""
+    parts = ["<p>"]
+    text_length = 0
+    link_chance = links / max(1, length / 8)
+
+    while text_length < length:
+        if rng.random() < link_chance:
+            part = f'<a href="https://example.com/{rng.choice(WORDS)}" ' \
+                   f'class="external-link" rel="nofollow">{rng.choice(WORDS)}</a> '
+        elif rng.random() < 0.05:
+            part = "</p>\n<p>"
+        else:
+            part = rng.choice(WORDS) + " "
+        parts.append(part)
+        text_length += len(part)
+
+    parts.append("</p>")
+    return "".join(parts)
+
+
+def create_rank(rng: random.Random, index: int, lexo_rank: bool) -> str:
+    """Create a rank value in LexoRank or the old numeric format."""
+    if lexo_rank:
+        suffix = "".join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(6))
+        return f"0|{suffix}:"
+    return str(index + 1)
+
+
+def write_export(file_path: str, item_count: int, description_length: int = 400,
+                 links: float = 1.0, assignee_count: int = 8, lexo_rank: bool = True,
+                 seed: int = 0):
+    """Write a synthetic export with the same structure as a Jira xml export."""
+    rng = random.Random(seed)
+    assignees = [f"Person{number}, Name" for number in range(assignee_count)] + ["Unassigned"]
+
+    with open(file_path, "w", encoding="utf-8") as export_file:
+        export_file.write('<rss version="0.92">\n<channel>\n<title>Jira</title>\n')
+        for index in range(item_count):
+            key = f"BEN-{index + 1}"
+            summary = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 9))).capitalize()
+            description = create_description(rng, description_length, links)
+            rank = create_rank(rng, index, lexo_rank)
+
+            export_file.write(f"""<item>
+    <title>[{key}] {summary}</title>
+    <link>https://example.com/browse/{key}</link>
+    <project id="10000" key="BEN">Benchmark</project>
+    <description>{html.escape(description, quote=False)}</description>
+    <environment></environment>
+    <key id="{10000 + index}">{key}</key>
+    <summary>{summary}</summary>
+    <type id="10002">Task</type>
+    <priority id="3">{rng.choice(PRIORITIES)}</priority>
+    <status id="10000">To Do</status>
+    <assignee username="-1">{rng.choice(assignees)}</assignee>
+    <reporter username="admin">Admin</reporter>
+    <customfields>
+        <customfield id="customfield_10019" key="com.pyxis.greenhopper.jira:gh-sprint">
+            <customfieldname>Sprint</customfieldname>
+            <customfieldvalues><customfieldvalue id="1">BEN Sprint 1</customfieldvalue></customfieldvalues>
+        </customfield>
+        <customfield id="customfield_10020" key="com.pyxis.greenhopper.jira:gh-lexo-rank">
+            <customfieldname>Rank</customfieldname>
+            <customfieldvalues><customfieldvalue>{rank}</customfieldvalue></customfieldvalues>
+        </customfield>
+    </customfields>
+</item>
+""")
+        export_file.write("</channel>\n</rss>\n")
+
+
+def sanitize_fields(xml_tree: elementTree):
+    """Run only the sanitizing of all card fields, without extracting entries."""
+    for item in xml_tree.iter("item"):
+        for key in ("summary", "assignee", "key", "priority"):
+            xml_parser.sanitize_value(item.find(key).text or "")
+        description = xml_parser.sanitize_description(item.find("description").text or "")
+        xml_parser.check_and_escape(description)
+
+
+class StageTimer:
+    """Records the duration of each stage and optionally its peak memory."""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.durations = {}
+        self.peaks = {}
+        self.start_time = 0
+
+    def start(self):
+        """Start timing the next stage."""
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.start_time = time.perf_counter()
+
+    def stop(self, stage: str):
+        """Record the stage that has just finished."""
+        self.durations[stage] = time.perf_counter() - self.start_time
+        if self.trace_memory:
+            self.peaks[stage] = tracemalloc.get_traced_memory()[1]
+
+
+def run_stages(input_path: str, output_path: str, item_count: int, timer: StageTimer):
+    """Run every stage once, timed separately."""
+    markup_validator.is_valid_markup.cache_clear()
+    xml_parser.SANITIZED_STRINGS.clear()
+    timer.start()
+    xml_tree = elementTree.parse(input_path)
+    timer.stop("parse")
+
+    timer.start()
+    entries = xml_parser.get_entries_from_xml(xml_tree)
+    timer.stop("entries")
+    assert len(entries) == item_count
+
+    # the entries stage has already sanitized all values, so start again with empty caches
+    markup_validator.is_valid_markup.cache_clear()
+    xml_parser.SANITIZED_STRINGS.clear()
+    timer.start()
+    sanitize_fields(xml_tree)
+    timer.stop("sanitize")
+    del xml_tree
+
+    creator = card_generator.Generator()
+    timer.start()
+    canvas = creator.create_canvas(output_path)
+    creator.draw_cards(canvas, entries)
+    timer.stop("render")
+
+    timer.start()
+    canvas.save()
+    timer.stop("save")
+
+
+def measure_peak_memory(input_path: str, output_path: str, item_count: int) -> dict:
+    """Run the stages again with tracemalloc and return the peak memory of each stage."""
+    timer = StageTimer(trace_memory=True)
+    tracemalloc.start()
+    try:
+        run_stages(input_path, output_path, item_count, timer)
+    finally:
+        tracemalloc.stop()
+    return timer.peaks
+
+
+def benchmark(item_count: int, description_length: int, links: float, assignee_count: int,
+              lexo_rank: bool, measure_memory: bool) -> dict:
+    """Create an export with the given settings and benchmark all stages on it."""
+    with tempfile.TemporaryDirectory() as work_directory:
+        input_path = os.path.join(work_directory, "export.xml")
+        output_path = os.path.join(work_directory, "export.pdf")
+        write_export(input_path, item_count, description_length, links, assignee_count,
+                     lexo_rank)
+
+        gc.collect()
+        timer = StageTimer()
+        run_stages(input_path, output_path, item_count, timer)
+        durations = timer.durations
+        result = {"items": item_count,
+                  "inputBytes": os.path.getsize(input_path),
+                  "outputBytes": os.path.getsize(output_path),
+                  "stages": {stage: {"seconds": round(durations[stage], 6),
+                                     "itemsPerSecond": round(item_count / durations[stage], 1)
+                                     if durations[stage] else None}
+                             for stage in STAGES}}
+
+        if measure_memory:
+            gc.collect()
+            peaks = measure_peak_memory(input_path, output_path, item_count)
+            for stage in STAGES:
+                result["stages"][stage]["peakMemoryBytes"] = peaks[stage]
+
+    return result
+
+
+def iter_with_first_page_time(entries: Iterable, cards_per_page: int, start: float,
+                              times: dict) -> Iterator:
+    """Yield the entries, noting when the entry after the first page is requested - by then
+    the first page has been drawn."""
+    for index, entry in enumerate(entries):
+        if index == cards_per_page:
+            times["firstPage"] = time.perf_counter() - start
+        yield entry
+
+
+def run_end_to_end(input_path: str, output_path: str, mode: str, queue_size: int) -> dict:
+    """Create the pdf from the xml file like the command line does, sequentially if no
+    pipeline mode is given, and return the total time and the time until the first page."""
+    markup_validator.is_valid_markup.cache_clear()
+    xml_parser.SANITIZED_STRINGS.clear()
+    creator = card_generator.Generator()
+    times = {}
+    start = time.perf_counter()
+    if mode is None:
+        entries = xml_parser.iter_entries_from_file(input_path)
+    else:
+        entries = pipeline.iter_pipelined(xml_parser.iter_entries_from_file, (input_path,), mode,
+                                          queue_size)
+    creator.create_pdf(iter_with_first_page_time(entries, creator.layout.cards_per_page, start,
+                                                 times), output_path)
+    times["total"] = time.perf_counter() - start
+    return times
+
+
+def benchmark_pipeline(item_count: int, description_length: int, links: float,
+                       assignee_count: int, lexo_rank: bool, queue_size: int,
+                       repetitions: int) -> dict:
+    """Compare the end to end throughput of the sequential and the pipelined modes, using the
+    median of several runs."""
+    with tempfile.TemporaryDirectory() as work_directory:
+        input_path = os.path.join(work_directory, "export.xml")
+        output_path = os.path.join(work_directory, "export.pdf")
+        write_export(input_path, item_count, description_length, links, assignee_count,
+                     lexo_rank)
+
+        result = {"items": item_count, "queueSize": queue_size, "modes": {}}
+        for mode in (None,) + pipeline.MODES:
+            runs = []
+            for _ in range(repetitions):
+                gc.collect()
+                runs.append(run_end_to_end(input_path, output_path, mode, queue_size))
+            total = statistics.median(run["total"] for run in runs)
+            result["modes"][mode or "sequential"] = {
+                "seconds": round(total, 6),
+                "itemsPerSecond": round(item_count / total, 1),
+                "firstPageSeconds": round(statistics.median(run.get("firstPage", run["total"])
+                                                            for run in runs), 6)}
+
+    return result
+
+
+def measure_startup(repetitions: int) -> dict:
+    """Run short command line invocations in new processes and return their median time."""
+    results = {}
+    for name, command in STARTUP_COMMANDS.items():
+        durations = []
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + command, cwd=PROJECT_DIRECTORY, check=True,
+                           stdout=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - start)
+        results[name] = {"medianSeconds": round(statistics.median(durations), 6)}
+
+    check = subprocess.run([sys.executable, "-c", "import sys, xml_parser; "
+                                                  "print('reportlab' in sys.modules)"],
+                           cwd=PROJECT_DIRECTORY, check=True, capture_output=True, text=True)
+    results["importParser"]["reportlabLoaded"] = check.stdout.strip() == "True"
+    return results
+
+
+def parse_arguments(arguments: list[str] = None) -> argparse.Namespace:
+    """Read the command line options."""
+    parser = argparse.ArgumentParser(description="Benchmark card generation with synthetic "
+                                                 "Jira xml exports.")
+    parser.add_argument("--items", type=int, nargs="+", default=DEFAULT_ITEM_COUNTS,
+                        help="item counts to benchmark (default: 100 10000 100000)")
+    parser.add_argument("--description-length", type=int, default=400,
+                        help="approximate length of each description in characters (default: 400)")
+    parser.add_argument("--links", type=float, default=1.0,
+                        help="average number of links per description (default: 1)")
+    parser.add_argument("--assignees", type=int, default=8,
+                        help="number of different assignees (default: 8)")
+    parser.add_argument("--old-rank", action="store_true",
+                        help="use the old numeric rank instead of LexoRank")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the second run that measures peak memory with tracemalloc")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure the start up time of short command line runs instead")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="compare whole runs of the sequential and pipelined modes instead")
+    parser.add_argument("--queue-size", type=int, default=pipeline.DEFAULT_QUEUE_SIZE,
+                        help="queue size in batches for --pipeline "
+                             f"(default: {pipeline.DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--repetitions", type=int, default=10,
+                        help="runs per command for --startup, or per mode for --pipeline "
+                             "(default: 10)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    return parser.parse_args(arguments)
+
+
+def main():
+    """Run the benchmarks and print or write the results."""
+    arguments = parse_arguments()
+
+    import reportlab
+    report = {"python": platform.python_version(),
+              "reportlab": reportlab.Version,
+              "platform": platform.platform(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+    if arguments.startup:
+        report["settings"] = {"repetitions": arguments.repetitions}
+        report["startup"] = measure_startup(arguments.repetitions)
+    elif arguments.pipeline:
+        report["settings"] = {"descriptionLength": arguments.description_length,
+                              "links": arguments.links,
+                              "assignees": arguments.assignees,
+                              "lexoRank": not arguments.old_rank,
+                              "repetitions": arguments.repetitions}
+        report["pipeline"] = [benchmark_pipeline(item_count, arguments.description_length,
+                                                 arguments.links, arguments.assignees,
+                                                 not arguments.old_rank, arguments.queue_size,
+                                                 arguments.repetitions)
+                              for item_count in arguments.items]
+    else:
+        report["settings"] = {"descriptionLength": arguments.description_length,
+                              "links": arguments.links,
+                              "assignees": arguments.assignees,
+                              "lexoRank": not arguments.old_rank}
+        report["results"] = []
+        for item_count in arguments.items:
+            report["results"].append(benchmark(item_count, arguments.description_length,
+                                               arguments.links, arguments.assignees,
+                                               not arguments.old_rank, not arguments.no_memory))
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
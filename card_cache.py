@@ -0,0 +1,113 @@
+"""Persistent on-disk cache for rendered card pages, so repeated runs on a changed export
+only have to render pages whose cards actually changed. Used by
+card_generator.Generator.create_pdf_cached."""
+import hashlib
+import json
+import os
+
+# change whenever the card layout changes, so pages rendered by older versions are not reused
+LAYOUT_VERSION = 3
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+
+class CardCache:
+    """Stores rendered pages in a directory, keyed by a hash of the cards they contain.
+    Besides the pages, the cache remembers the assignee colors and the cards of the last
+    run, so colors stay the same between runs and changed cards can be found."""
+
+    INDEX_FILE = "index.json"
+    PAGE_DIRECTORY = "pages"
+
+    def __init__(self, cache_directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_directory = cache_directory
+        self.page_directory = os.path.join(cache_directory, self.PAGE_DIRECTORY)
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.page_directory, exist_ok=True)
+        self.index = self.load_index()
+
+    def load_index(self) -> dict:
+        """Load colors and card keys of the last run, or start empty if there was none."""
+        index_path = os.path.join(self.cache_directory, self.INDEX_FILE)
+        try:
+            with open(index_path, encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            index = {}
+
+        if index.get("layoutVersion") != LAYOUT_VERSION:
+            index = {}
+        index.setdefault("colors", {})
+        index.setdefault("cards", [])
+        return index
+
+    def save_index(self):
+        """Write colors and card keys for the next run."""
+        self.index["layoutVersion"] = LAYOUT_VERSION
+        index_path = os.path.join(self.cache_directory, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(index_path + ".tmp", index_path)
+
+    def get_colors(self) -> dict[str, tuple[float, float, float]]:
+        """Get the assignee colors used in the last run."""
+        return {assignee: tuple(color) for assignee, color in self.index["colors"].items()}
+
+    def set_colors(self, used_colors: dict[str, tuple[float, float, float]]):
+        """Remember the assignee colors for the next run."""
+        self.index["colors"] = {assignee: list(color) for assignee, color in used_colors.items()}
+
+    def get_previous_cards(self) -> set[str]:
+        """Get the keys of all cards rendered in the last run."""
+        return set(self.index["cards"])
+
+    def set_previous_cards(self, card_keys: list[str]):
+        """Remember the keys of the cards rendered in this run."""
+        self.index["cards"] = card_keys
+
+    @staticmethod
+    def get_card_key(entry: dict[str, str], card_color: tuple[float, float, float]) -> str:
+        """Hash all values shown on a card, together with its color."""
+        card_data = json.dumps([LAYOUT_VERSION, sorted(entry.items()), card_color])
+        return hashlib.sha256(card_data.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_page_key(card_keys: list[str], layout_key: str, compress: bool = True) -> str:
+        """Hash the keys of all cards on a page, in the order they are placed, together with
+        the page layout and whether the page is compressed."""
+        compression = "compressed" if compress else "uncompressed"
+        page_data = " ".join([layout_key, compression] + card_keys)
+        return hashlib.sha256(page_data.encode("utf-8")).hexdigest()
+
+    def get_page_path(self, page_key: str) -> str:
+        """Get the path a page with this key is stored at."""
+        return os.path.join(self.page_directory, page_key + ".pdf")
+
+    def has_page(self, page_key: str) -> bool:
+        """Check if the page is cached and mark it as recently used if it is."""
+        page_path = self.get_page_path(page_key)
+        if os.path.exists(page_path):
+            os.utime(page_path)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def evict(self):
+        """Delete the least recently used pages until the cache is smaller than its limit."""
+        pages = []
+        for file_entry in os.scandir(self.page_directory):
+            if file_entry.is_file():
+                stat = file_entry.stat()
+                pages.append((stat.st_mtime, stat.st_size, file_entry.path))
+
+        cache_size = sum(size for _, size, _ in pages)
+        for _, size, page_path in sorted(pages):
+            if cache_size <= self.max_size:
+                break
+            os.remove(page_path)
+            cache_size -= size
@@ -0,0 +1,107 @@
+"""Selects the backlog items to print, for reprinting a few lost or changed cards. Filters
+work on the raw values of an item, so items that are not selected are skipped before their
+values are sanitized."""
+import html
+import re
+
+import card_record
+
+PROJECT_PATTERN = r"(?:[A-Za-z][A-Za-z0-9_]*-)?"
+# a key number or a range of them, each optionally with its project, like 12, CG-12 or 12-15
+KEY_PATTERN = re.compile(rf"{PROJECT_PATTERN}(\d+)(?:-{PROJECT_PATTERN}(\d+))?")
+RANGE_SEPARATOR = ".."
+# positions of the filtered values in the values of card_record.FIELDS
+FILTERED_FIELDS = [card_record.FIELDS.index(field)
+                   for field in ("key", "assignee", "priority", "rank")]
+
+
+class CardFilter:
+    """Matches items by key, assignee, priority and rank. An item has to match every given
+    criterion, criteria that are None match all items.
+
+    Keys are compared by their number only. Ranks are compared as numbers if both are old
+    numeric ranks, and as strings otherwise, which is the order of LexoRank values."""
+
+    def __init__(self, keys: str = None, assignees: list[str] = None,
+                 priorities: list[str] = None, ranks: str = None):
+        self.key_numbers, self.key_ranges = parse_keys(keys) if keys else (None, None)
+        self.assignees = {assignee.casefold() for assignee in assignees} if assignees else None
+        self.priorities = {priority.casefold() for priority in priorities} if priorities else None
+        self.rank_range = parse_rank_range(ranks) if ranks else None
+
+    def is_empty(self) -> bool:
+        """Check if the filter selects every item."""
+        return self.key_numbers is None and self.assignees is None and \
+            self.priorities is None and self.rank_range is None
+
+    def matches(self, key: str, assignee: str, priority: str, rank: str) -> bool:
+        """Check if an item with these raw values is selected."""
+        if self.key_numbers is not None and not self.matches_key(key):
+            return False
+        if self.assignees is not None and unescape(assignee).casefold() not in self.assignees:
+            return False
+        if self.priorities is not None and unescape(priority).casefold() not in self.priorities:
+            return False
+        if self.rank_range is not None:
+            low, high = self.rank_range
+            rank_key = get_rank_key(unescape(rank))
+            if (low is not None and rank_key < low) or (high is not None and rank_key > high):
+                return False
+        return True
+
+    def matches_values(self, values: tuple[str, ...]) -> bool:
+        """Check if an item with these raw values, in the order of card_record.FIELDS, is
+        selected."""
+        return self.matches(*(values[index] for index in FILTERED_FIELDS))
+
+    def matches_key(self, key: str) -> bool:
+        """Check if the number of the key is one of the selected ones."""
+        number = key.rpartition("-")[2].strip()
+        if not number.isdigit():
+            return False
+        number = int(number)
+        return number in self.key_numbers or \
+            any(first <= number <= last for first, last in self.key_ranges)
+
+
+def parse_keys(keys: str) -> (set[int], list[tuple[int, int]]):
+    """Read a comma separated list of keys and key ranges, like "12, 15-20, CG-31"."""
+    numbers = set()
+    ranges = []
+    for part in keys.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        match = KEY_PATTERN.fullmatch(part)
+        if not match:
+            raise ValueError(f"Invalid key or key range: {part}")
+        first, last = match.groups()
+        if last is None:
+            numbers.add(int(first))
+        else:
+            ranges.append((min(int(first), int(last)), max(int(first), int(last))))
+    return numbers, ranges
+
+
+def parse_rank_range(ranks: str) -> (tuple, tuple):
+    """Read a rank range like "100..250" or "0|hzzzz7:..0|i0000f:", either end may be left
+    out. Returns the comparison keys of both ends, None for an open end."""
+    if RANGE_SEPARATOR not in ranks:
+        raise ValueError(f"Invalid rank range: {ranks}, use FROM..TO")
+    low, high = (part.strip() for part in ranks.split(RANGE_SEPARATOR, 1))
+    return (get_rank_key(low) if low else None), (get_rank_key(high) if high else None)
+
+
+def get_rank_key(rank: str) -> tuple:
+    """Get the value ranks are compared by, old numeric ranks come before LexoRank values."""
+    rank = (rank or "").strip()
+    if rank.isdigit():
+        return 0, int(rank), ""
+    return 1, 0, rank
+
+
+def unescape(value: str) -> str:
+    """Get the text of a value, the readers of input_adapters.py deliver markup."""
+    if not value:
+        return ""
+    return html.unescape(value) if "&" in value else value
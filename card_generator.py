@@ -1,17 +1,52 @@
 """Creates a pdf with cards for passed backlog items - use xml_parser.py module to read the
 backlog items from a xml file and get the required format for this module."""
-import html
-import random
-
-import reportlab.lib.pagesizes as sizes
+import colorsys
+import concurrent.futures
+import itertools
+import math
+import os
+import tempfile
+import time
+import zlib
+from typing import Iterable, NamedTuple, Union
+
+import reportlab
 import reportlab.lib.units as layout_units
 import reportlab.pdfgen.canvas as pdf_canvas
 from reportlab.lib import colors as reportlab_colors
 from reportlab.lib.styles import ParagraphStyle
-from reportlab.platypus import Frame
 from reportlab.platypus import Paragraph
 from reportlab.platypus import Table, TableStyle
 
+import card_cache
+import card_layout
+import card_record
+import fragment_cache
+import markup_validator
+import profiling
+import text_fitting
+from card_cache import CardCache
+from card_layout import Layout
+from card_record import Card
+
+# cached paragraphs are only valid for the same card layout and reportlab version
+FRAGMENT_VERSION = f"layout {card_cache.LAYOUT_VERSION}, reportlab {reportlab.Version}"
+MAX_PARAGRAPH_BYTES = 64 * 1024 * 1024
+# the card template refers to a font dictionary, which refers to the fonts - copies only become
+# identical once the objects they refer to were merged, so each level needs a pass of its own
+MERGE_PASSES = 3
+# rough memory used by a laid out paragraph, measured with tracemalloc - the words and lines
+# of a wrapped paragraph take many times the size of its text
+PARAGRAPH_SIZE = 2048
+PARAGRAPH_SIZE_PER_CHARACTER = 50
+
+
+class AssigneeStyle(NamedTuple):
+    """Everything on a card that only depends on its assignee, computed once per assignee."""
+    card_color: tuple[float, float, float]
+    first_line: ParagraphStyle
+    processor_name: str
+
 
 class Generator:
     """Use to create a pdf file containing cards for each backlog items.
@@ -19,65 +54,350 @@ class Generator:
     internally."""
 
     UNASSIGNED = "Unassigned"
-    LARGE_RANK_STYLE = "largeRankStyle"
-    LARGE_RANK_STYLE_UNASSIGNED = "largeRankStyleUnassigned"
     FIRST_LINE = "firstLine"
     FIRST_LINE_UNASSIGNED = "firstLineUnassigned"
     ROYAL_BLUE = (0 / 256, 85 / 256, 164 / 256)
-
-    def __init__(self):
-        self.start_x = 10
-        self.start_y = 325
-        self.frame_count = 1
-
+    # colors generated once the named colors are used up are light, so black text stays readable
+    GENERATED_COLOR_LIGHTNESS = 0.78
+    GENERATED_COLOR_SATURATION = 0.75
+    GOLDEN_RATIO_CONJUGATE = 0.618033988749895
+    # number of generated colors an assignee's search for a free color may start at
+    GENERATED_COLOR_SLOTS = 32
+
+    CARD_TEMPLATE = "cardTemplate"
+    CARD_WIDTH = card_layout.CARD_WIDTH
+    CARD_HEIGHT = card_layout.CARD_HEIGHT
+    COLUMN_WIDTHS = [2.7 * layout_units.cm, 11.3 * layout_units.cm]
+    ROW_HEIGHTS = [1.2 * layout_units.cm, 3.4 * layout_units.cm,
+                   2.1 * layout_units.cm, 1.2 * layout_units.cm]
+    # paddings match the defaults of reportlab frames and tables the cards used to be built with
+    FRAME_PADDING = 6
+    CELL_PADDING_HORIZONTAL = 6
+    CELL_PADDING_TOP = 3
+    CELL_PADDING_BOTTOM = 3
+    HEADER_PADDING_BOTTOM = 14
+    # font sizes tried for each kind of cell, from the preferred size down to the smallest
+    # readable one - texts that don't fit at the smallest size are truncated
+    FIRST_LINE_SIZES = (18, 16, 14, 13, 12, 11, 10, 9)
+    SUMMARY_SIZES = (22, 20, 18, 16, 14, 12)
+    DESCRIPTION_SIZES = (11, 10, 9)
+    PROCESSOR_SIZES = (20, 18, 16, 15, 14, 12, 10)
+    BACK_KEY_FONT_SIZE = 60
+    LINE_WIDTH = 0.9
+
+    def __init__(self, layout: Layout = None, compress: bool = True):
+        self.layout = layout if layout is not None else Layout()
+        self.compress = compress
+        # (path, pages, seconds spent writing) of every pdf file written, for the output report
+        self.output_files = []
+        self.card_index = 0
+        # cards of the current page, only kept for their back sides in duplex layouts
+        self.page_entries = []
+
+        # all named colors in a fixed order, and the ones that are still free
+        self.named_colors = []
         self.colors = []
         self.used_colors = {}
         self.styles = {}
+        self.sized_styles = {}
+        self.assignee_styles = {}
+        # laid out paragraphs by text, style and cell, they keep the styles they were created
+        # with, which are the same for every run. Disabled unless resized, like xml_parser.py
+        # does for --fragment-cache
+        self.paragraphs = fragment_cache.FragmentCache("paragraph", 0)
+
+    def create_pdf(self, entries: Iterable[Union[Card, dict[str, str]]], output_path: str):
+        """Create the output pdf file. Entries can be any iterable of card records or
+        dictionaries, like a list, a card_record.CardBatch or a generator. They are rendered one
+        at a time, so a generator like xml_parser.iter_entries_from_file keeps memory low."""
+        canvas = self.create_canvas(output_path)
+        self.draw_cards(canvas, entries)
+        self.save_canvas(canvas, output_path)
+
+    def create_pdf_parts(self, entries: Iterable[Union[Card, dict[str, str]]], output_path: str,
+                         pages_per_part: int) -> list[str]:
+        """Create the output as several pdf files with up to the given number of pages of cards
+        each, named like the output path with "_part1", "_part2" and so on appended. Every part
+        is written and freed as soon as it is full, so memory use doesn't grow with the number
+        of pages. Returns the paths of the parts."""
+        self.load_colors()
+        self.load_styles()
 
-    def create_pdf(self, entries: list[dict[str, str]], output_path: str):
-        """Create the output pdf file."""
+        entries = iter(entries)
+        cards_per_part = self.layout.cards_per_page * pages_per_part
+        part_paths = []
+        while True:
+            part_entries = list(itertools.islice(entries, cards_per_part))
+            if not part_entries:
+                break
+
+            part_path = get_part_path(output_path, len(part_paths) + 1)
+            canvas = self.open_canvas(part_path)
+            self.draw_cards(canvas, part_entries)
+            self.save_canvas(canvas, part_path)
+            part_paths.append(part_path)
+
+        # parts of an earlier, longer run would otherwise look like they belong to this one
+        part_number = len(part_paths) + 1
+        while os.path.exists(get_part_path(output_path, part_number)):
+            os.remove(get_part_path(output_path, part_number))
+            part_number += 1
+
+        return part_paths
+
+    def create_canvas(self, output_path: str) -> pdf_canvas.Canvas:
+        """Prepare colors, styles and a canvas with the card template for drawing cards."""
         self.load_colors()
         self.load_styles()
+        return self.open_canvas(output_path)
 
+    def open_canvas(self, output_path: str) -> pdf_canvas.Canvas:
+        """Create a canvas with the card template, colors and styles have to be loaded already."""
         canvas = pdf_canvas.Canvas(filename=output_path, bottomup=1,
-                                   pagesize=sizes.landscape(sizes.A4))
+                                   pagesize=self.layout.page_size,
+                                   pageCompression=None if self.compress else 0)
+        self.load_card_template(canvas)
+        return canvas
+
+    def save_canvas(self, canvas: pdf_canvas.Canvas, output_path: str):
+        """Write the canvas to its file and remember its pages and write time for the report."""
+        start = time.perf_counter()
+        with profiling.stage("save"):
+            canvas.save()
+        # the page number is already one past the last page once the canvas is saved
+        self.output_files.append((output_path, canvas.getPageNumber() - 1,
+                                  time.perf_counter() - start))
+
+    def merge_parts(self, part_paths: list[str], output_path: str):
+        """Merge rendered parts into the output file and remember it for the report."""
+        start = time.perf_counter()
+        page_count = merge_pdfs(part_paths, output_path)
+        self.output_files.append((output_path, page_count, time.perf_counter() - start))
+
+    def get_output_report(self) -> dict:
+        """Summarize the pdf files written so far - their size, pages and the time it took to
+        write them. Parts rendered by worker processes only count once they are merged."""
+        total_bytes = sum(os.path.getsize(path) for path, _, _ in self.output_files)
+        total_pages = sum(pages for _, pages, _ in self.output_files)
+        return {"files": [path for path, _, _ in self.output_files],
+                "bytes": total_bytes,
+                "pages": total_pages,
+                "bytesPerPage": round(total_bytes / total_pages) if total_pages else None,
+                "writeSeconds": round(sum(seconds for _, _, seconds in self.output_files), 6)}
+
+    def draw_cards(self, canvas: pdf_canvas.Canvas, entries: Iterable[Union[Card, dict[str, str]]]):
+        """Draw a card for every entry, the canvas still has to be saved afterwards."""
+        for entry in entries:
+            with profiling.stage("render"):
+                self.build_card_for_entry(canvas, card_record.as_card(entry))
+            profiling.count("cardsRendered")
+
+        if self.card_index != 0:
+            # the last page isn't full
+            self.finish_page(canvas)
+
+    def create_pdf_parallel(self, entries: Iterable[Union[Card, dict[str, str]]], output_path: str,
+                            workers: int):
+        """Create the output pdf file using several processes. Entries are split into chunks
+        of whole pages, every chunk is rendered by a worker process and the parts are merged
+        into one pdf in their original order."""
+        entries = [card_record.as_card(entry) for entry in entries]
+        self.load_colors()
+        self.assign_colors(entries)
+
+        chunks = self.split_into_page_chunks(entries, workers)
+        with tempfile.TemporaryDirectory() as part_directory:
+            part_paths = [os.path.join(part_directory, f"part{index}.pdf")
+                          for index in range(len(chunks))]
+
+            render_parts(list(zip(chunks, part_paths)), self.used_colors, self.layout,
+                         self.compress, workers)
+            self.merge_parts(part_paths, output_path)
+
+    def create_pdf_cached(self, entries: Iterable[Union[Card, dict[str, str]]], output_path: str,
+                          cache: CardCache, delta_path: str = None, workers: int = 1):
+        """Create the output pdf file, reusing pages rendered by earlier runs. Only pages
+        with changed cards are rendered, all pages are merged into the output afterwards.
+        If a delta path is given, the cards that were not part of the last run are also
+        written to a separate pdf for reprinting. Returns the number of these changed cards."""
+        entries = [card_record.as_card(entry) for entry in entries]
+        self.load_colors()
+        self.restore_colors(cache.get_colors())
+        self.assign_colors(entries)
+        cache.set_colors(self.used_colors)
+
+        card_keys = [cache.get_card_key(entry, self.get_first_line_style(entry.assignee)[0])
+                     for entry in entries]
+
+        page_paths = []
+        missing_pages = []
+        missing_page_keys = set()
+        cards_per_page = self.layout.cards_per_page
+        for index in range(0, len(entries), cards_per_page):
+            page_key = cache.get_page_key(card_keys[index:index + cards_per_page],
+                                          self.layout.get_key(), self.compress)
+            page_path = cache.get_page_path(page_key)
+            page_paths.append(page_path)
+            if page_key not in missing_page_keys and not cache.has_page(page_key):
+                missing_page_keys.add(page_key)
+                missing_pages.append((entries[index:index + cards_per_page], page_path))
+
+        render_parts(missing_pages, self.used_colors, self.layout, self.compress, workers,
+                     self.paragraphs)
+        self.merge_parts(page_paths, output_path)
+
+        previous_cards = cache.get_previous_cards()
+        changed_entries = [entry for entry, card_key in zip(entries, card_keys)
+                           if card_key not in previous_cards]
+        if delta_path is not None:
+            if changed_entries:
+                render_part(changed_entries, delta_path, self.used_colors, self.layout,
+                            self.compress, self.paragraphs)
+            elif os.path.exists(delta_path):
+                # don't leave the changes of an earlier run around to be printed again
+                os.remove(delta_path)
+
+        cache.set_previous_cards(card_keys)
+        cache.save_index()
+        cache.evict()
+
+        return len(changed_entries)
+
+    def restore_colors(self, used_colors: dict[str, tuple[float, float, float]]):
+        """Reuse assignee colors of an earlier run, so cards of the same person keep their color."""
+        for assignee, card_color in used_colors.items():
+            if card_color in self.colors:
+                self.colors.remove(card_color)
+            self.used_colors[assignee] = card_color
 
+    def assign_colors(self, entries: Iterable[Card]):
+        """Choose the colors for all assignees up front, so every worker uses the same ones."""
         for entry in entries:
-            self.build_card_for_entry(canvas, entry)
+            self.get_first_line_style(entry.assignee)
+
+    def split_into_page_chunks(self, entries: list[Card], workers: int) -> list[list[Card]]:
+        """Split entries into chunks that always start on a new page, with a few chunks
+        per worker so the work is spread evenly."""
+        page_count = math.ceil(len(entries) / self.layout.cards_per_page)
+        pages_per_chunk = max(1, math.ceil(page_count / (workers * 4)))
+        chunk_size = pages_per_chunk * self.layout.cards_per_page
+
+        return [entries[index:index + chunk_size] for index in range(0, len(entries), chunk_size)]
+
+    def load_card_template(self, canvas: pdf_canvas.Canvas):
+        """Draw the parts that are the same on every card (grid, border and labels) once into
+        a reusable form, so each card only has to draw its own content on top of it."""
+        label_style = self.styles["label"]
+        table_data = [["", ""],
+                      ["", ""],
+                      [Paragraph("Description:", label_style), ""],
+                      [Paragraph("Processor:", label_style), ""]]
+
+        card_style = TableStyle([('VALIGN', (0, 1), (-1, -1), "TOP"),
+                                 ('INNERGRID', (0, 0), (-1, -1), self.LINE_WIDTH,
+                                  reportlab_colors.black),
+                                 ('BOX', (0, 0), (-1, -1), self.LINE_WIDTH, reportlab_colors.black)])
+        table = Table(data=table_data, colWidths=self.COLUMN_WIDTHS, rowHeights=self.ROW_HEIGHTS)
+        table.setStyle(card_style)
 
-        canvas.save()
+        canvas.beginForm(self.CARD_TEMPLATE)
+        table.wrapOn(canvas, sum(self.COLUMN_WIDTHS), sum(self.ROW_HEIGHTS))
+        table.drawOn(canvas, 0, 0)
+        canvas.endForm()
 
-    def build_card_for_entry(self, canvas: pdf_canvas.Canvas, entry: dict[str, str]):
+    def build_card_for_entry(self, canvas: pdf_canvas.Canvas, entry: Card):
         """Create a card for the given backlog item."""
-        assignee = entry["assignee"]
-        rank = entry["rank"]
+        assignee_style = self.get_assignee_style(entry.assignee)
+        table_data = self.get_table_data(entry, assignee_style)
 
-        card_color, first_line_style = self.get_first_line_style(assignee)
-        rank_style = self.get_rank_style(rank, assignee, first_line_style)
+        canvas.saveState()
+        self.move_to_card(canvas, self.layout.positions[self.card_index])
 
-        frame_content = []
+        canvas.setFillColor(assignee_style.card_color)
+        self.draw_header(canvas)
+        canvas.doForm(self.CARD_TEMPLATE)
 
-        table_data = self.get_table_data(entry, first_line_style, rank_style)
+        for row, row_data in enumerate(table_data):
+            for column, cell_paragraph in enumerate(row_data):
+                if cell_paragraph is not None:
+                    self.draw_cell(canvas, cell_paragraph, row, column)
 
-        card_frame = Frame(self.start_x, self.start_y, width=14.5 * layout_units.cm,
-                           height=8.5 * layout_units.cm, showBoundary=0)
+        canvas.restoreState()
 
-        card_style = TableStyle([('BACKGROUND', (0, 0), (1, 0), card_color),
-                                 ('VALIGN', (0, 0), (1, 0), "MIDDLE"),
-                                 ('BOTTOMPADDING', (0, 0), (1, 0), 14),
-                                 ('VALIGN', (0, 1), (-1, -1), "TOP"),
-                                 ('INNERGRID', (0, 0), (-1, -1), 0.9, reportlab_colors.black),
-                                 ('BOX', (0, 0), (-1, -1), 0.9, reportlab_colors.black)])
-        table = Table(data=table_data,
-                      colWidths=[2.7 * layout_units.cm, 11.3 * layout_units.cm],
-                      rowHeights=[1.2 * layout_units.cm, 3.4 * layout_units.cm,
-                                  2.1 * layout_units.cm, 1.2 * layout_units.cm])
-        table.setStyle(card_style)
+        if self.layout.duplex:
+            self.page_entries.append(entry)
+        self.get_new_card_position(canvas)
 
-        frame_content.append(table)
-        card_frame.addFromList(frame_content, canvas)
+    def build_back_for_entry(self, canvas: pdf_canvas.Canvas, entry: Card,
+                             position: tuple[float, float]):
+        """Create the back side of a card, showing its key in the color of its assignee."""
+        table_width = sum(self.COLUMN_WIDTHS)
+        table_height = sum(self.ROW_HEIGHTS)
+
+        canvas.saveState()
+        self.move_to_card(canvas, position)
+
+        canvas.setFillColor(self.get_assignee_style(entry.assignee).card_color)
+        self.draw_header(canvas)
+        canvas.setLineWidth(self.LINE_WIDTH)
+        canvas.rect(0, 0, table_width, table_height, stroke=1, fill=0)
+
+        canvas.setFillColor(reportlab_colors.black)
+        canvas.setFont("Helvetica-Bold", self.BACK_KEY_FONT_SIZE)
+        key_y = (table_height - self.ROW_HEIGHTS[0] - self.BACK_KEY_FONT_SIZE * 0.7) / 2
+        canvas.drawCentredString(table_width / 2, key_y, entry.key)
+
+        canvas.restoreState()
+
+    def move_to_card(self, canvas: pdf_canvas.Canvas, position: tuple[float, float]):
+        """Move the origin to the lower left corner of the card table at the given position of
+        the layout and scale it to the card size of the layout."""
+        card_x, card_y = position
+        canvas.translate(card_x, card_y)
+        canvas.scale(self.layout.scale, self.layout.scale)
+
+        # center the table horizontally and put it at the top of the card, like a frame would
+        table_x = self.FRAME_PADDING + \
+            (self.CARD_WIDTH - 2 * self.FRAME_PADDING - sum(self.COLUMN_WIDTHS)) / 2
+        table_y = self.CARD_HEIGHT - self.FRAME_PADDING - sum(self.ROW_HEIGHTS)
+        canvas.translate(table_x, table_y)
+
+    def draw_header(self, canvas: pdf_canvas.Canvas):
+        """Fill the first row of the card table with the current fill color."""
+        canvas.rect(0, sum(self.ROW_HEIGHTS[1:]), sum(self.COLUMN_WIDTHS), self.ROW_HEIGHTS[0],
+                    stroke=0, fill=1)
+
+    def draw_cell(self, canvas: pdf_canvas.Canvas, paragraph: Paragraph, row: int, column: int):
+        """Draw a paragraph into the given cell of the card template. The first row is centered
+        vertically, all other rows start at the top of their cell."""
+        cell_x = sum(self.COLUMN_WIDTHS[:column])
+        cell_y = sum(self.ROW_HEIGHTS[row + 1:])
+        cell_width = self.COLUMN_WIDTHS[column]
+        cell_height = self.ROW_HEIGHTS[row]
+
+        available_width = cell_width - 2 * self.CELL_PADDING_HORIZONTAL
+        if getattr(paragraph, "width", None) == available_width:
+            # a cached paragraph that has been wrapped to this cell before
+            paragraph_height = paragraph.height
+        else:
+            _, paragraph_height = paragraph.wrap(available_width, cell_height)
+        if row == 0:
+            paragraph_y = cell_y + (cell_height + self.HEADER_PADDING_BOTTOM -
+                                    self.CELL_PADDING_TOP - paragraph_height) / 2
+        else:
+            paragraph_y = cell_y + cell_height - self.CELL_PADDING_TOP - paragraph_height
 
-        self.get_new_card_position(canvas)
+        paragraph.drawOn(canvas, cell_x + self.CELL_PADDING_HORIZONTAL, paragraph_y)
+
+    def get_assignee_style(self, assignee: str) -> AssigneeStyle:
+        """Get color and styles of the cards of an assignee, they are computed on first use."""
+        assignee_style = self.assignee_styles.get(assignee)
+        if assignee_style is None:
+            card_color, first_line_style = self.get_first_line_style(assignee)
+            assignee_style = AssigneeStyle(card_color, self.styles[first_line_style],
+                                           self.get_processor_name(assignee))
+            self.assignee_styles[assignee] = assignee_style
+        return assignee_style
 
     def get_first_line_style(self, assignee: str) -> (tuple[float, float, float], str):
         """Get the style used for the first line of a card."""
@@ -90,7 +410,7 @@ class Generator:
         return card_color, first_line_style
 
     def load_colors(self):
-        """Load the colors used for generated cards."""
+        """Load the colors used for generated cards, without the ones assignees already have."""
         olive = (192 / 256, 255 / 256, 62 / 256)
         light_blue = (135 / 256, 206 / 256, 250 / 256)
         hot_pink = (255 / 256, 110 / 256, 180 / 256)
@@ -102,71 +422,119 @@ class Generator:
         dark_orange = (255 / 256, 140 / 256, 0 / 256)
         medium_purple = (171 / 256, 130 / 256, 255 / 256)
 
-        self.colors = [olive, light_blue, hot_pink, gold, salmon,
-                       pale_green, light_grey, dark_turquoise, dark_orange, medium_purple]
+        self.named_colors = [olive, light_blue, hot_pink, gold, salmon,
+                             pale_green, light_grey, dark_turquoise, dark_orange, medium_purple]
+        taken_colors = set(self.used_colors.values())
+        self.colors = [card_color for card_color in self.named_colors
+                       if card_color not in taken_colors]
 
     def get_card_color(self, assignee: str):
-        """Get the color used for this assignee."""
+        """Get the color used for this assignee. The search for a free color starts at a place
+        chosen by the name, so an assignee keeps their color when the backlog is reordered or
+        others are added, unless two names start at the same place."""
         if assignee in self.used_colors:
-            card_color = self.used_colors[assignee]
-        else:
-            card_color = random.choice(self.colors)
-            self.used_colors[assignee] = card_color
+            return self.used_colors[assignee]
+
+        name_hash = get_name_hash(assignee)
+        if self.colors:
+            start = name_hash % len(self.named_colors) if self.named_colors else 0
+            search_order = self.named_colors[start:] + self.named_colors[:start]
+            card_color = next((card_color for card_color in search_order
+                               if card_color in self.colors), self.colors[0])
             self.colors.remove(card_color)
-
+        else:
+            card_color = self.generate_color(name_hash % self.GENERATED_COLOR_SLOTS)
+        self.used_colors[assignee] = card_color
         return card_color
 
-    def get_table_data(self, entry: dict[str, str], first_line_style: str, rank_style: str) -> list[list[Paragraph]]:
-        """Put all card elements together to create a table for reportlab to render."""
-        priority_paragraph = Paragraph(entry["priority"], self.styles[first_line_style])
-        summary_paragraph = Paragraph(entry["summary"], self.styles["summary"])
-        description_label_paragraph = Paragraph("Description:", self.styles["label"])
-        key_paragraph = Paragraph(entry["key"], self.styles["summary"])
-
-        processor_label_paragraph = Paragraph("Processor:", self.styles["label"])
-        rank_paragraph = Paragraph(entry["rank"], self.styles[rank_style])
+    def generate_color(self, start: int = 0) -> tuple[float, float, float]:
+        """Create another light color for teams with more assignees than named colors. The hues
+        are spread with the golden ratio, so neighbouring colors are easy to tell apart."""
+        color_number = start
+        while True:
+            hue = (color_number * self.GOLDEN_RATIO_CONJUGATE) % 1
+            color_number += 1
+            card_color = colorsys.hls_to_rgb(hue, self.GENERATED_COLOR_LIGHTNESS,
+                                             self.GENERATED_COLOR_SATURATION)
+            # colors restored from an earlier run may already include generated ones
+            if card_color not in self.used_colors.values():
+                return card_color
+
+    def get_table_data(self, entry: Card,
+                       assignee_style: AssigneeStyle) -> list[list[Paragraph]]:
+        """Put all card elements together, cells that only contain a label of the card
+        template are left empty."""
+        first_line_style = assignee_style.first_line
+        summary_style = self.styles["summary"]
+
+        rank_paragraph = self.fit_paragraph(entry.rank, first_line_style, self.FIRST_LINE_SIZES,
+                                            0, 0, max_lines=1)
+        priority_paragraph = self.fit_paragraph(entry.priority, first_line_style,
+                                                self.FIRST_LINE_SIZES, 0, 1, max_lines=1)
+        key_paragraph = self.fit_paragraph(entry.key, summary_style, self.SUMMARY_SIZES, 1, 0,
+                                           max_lines=1)
+        summary_paragraph = self.fit_paragraph(entry.summary, summary_style, self.SUMMARY_SIZES,
+                                               1, 1)
         description_paragraph = self.get_description_paragraph(entry)
-        processor_paragraph = self.get_processor_paragraph(entry["assignee"])
+        processor_paragraph = self.fit_paragraph(assignee_style.processor_name,
+                                                 self.styles["processor"], self.PROCESSOR_SIZES,
+                                                 3, 1, max_lines=1)
 
         data = [[rank_paragraph, priority_paragraph],
                 [key_paragraph, summary_paragraph],
-                [description_label_paragraph, description_paragraph],
-                [processor_label_paragraph, processor_paragraph]]
+                [None, description_paragraph],
+                [None, processor_paragraph]]
         return data
 
-    def get_processor_paragraph(self, assignee: str) -> Paragraph:
-        """Get paragraph style used for processor field."""
+    def get_processor_name(self, assignee: str) -> str:
+        """Get the name shown in the processor field."""
         # remove "Unassigned" so people can fill out the cards themselves
         if assignee == self.UNASSIGNED:
-            assignee = ""
-
-        if len(assignee) > 30:
-            processor_paragraph = Paragraph(assignee, self.styles["smallProcessor"])
-        else:
-            processor_paragraph = Paragraph(assignee, self.styles["processor"])
-        return processor_paragraph
-
-    def get_description_paragraph(self, entry: dict[str, str]) -> Paragraph:
-        """Get paragraph style used for description field."""
-        description_string = entry.get("description", '')
-
-        try:
-            description_paragraph = Paragraph(description_string, self.styles["description"])
-        except ValueError:
-            description_string = html.escape(description_string)
-            description_paragraph = Paragraph(description_string, self.styles["description"])
-        return description_paragraph
-
-    def get_rank_style(self, rank: str, assignee: str, first_line_style: str):
-        """Get style for rank field."""
-        if len(rank) >= 7:
-            if assignee == self.UNASSIGNED:
-                rank_style = self.LARGE_RANK_STYLE_UNASSIGNED
-            else:
-                rank_style = self.LARGE_RANK_STYLE
-        else:
-            rank_style = first_line_style
-        return rank_style
+            return ""
+        return assignee
+
+    def get_description_paragraph(self, entry: Card) -> Paragraph:
+        """Get paragraph used for description field."""
+        # entries don't have to come from xml_parser, so the description is validated here too
+        description_string = markup_validator.escape_if_invalid(entry.description)
+        return self.fit_paragraph(description_string, self.styles["description"],
+                                  self.DESCRIPTION_SIZES, 2, 1)
+
+    def fit_paragraph(self, text: str, style: ParagraphStyle, font_sizes: tuple[float, ...],
+                      row: int, column: int, max_lines: int = None) -> Paragraph:
+        """Get a paragraph of the text in the largest of the font sizes that fits into the given
+        cell, or truncated at the smallest size if it doesn't fit at all. Paragraphs are cached,
+        a cached paragraph has already been wrapped to its cell when it was drawn before."""
+        cache_key = (text, style.name, font_sizes, row, column, max_lines)
+        paragraph = self.paragraphs.get(cache_key)
+        if paragraph is not None:
+            return paragraph
+
+        width = self.COLUMN_WIDTHS[column] - 2 * self.CELL_PADDING_HORIZONTAL
+        height = self.ROW_HEIGHTS[row] - self.CELL_PADDING_TOP - self.CELL_PADDING_BOTTOM
+        with self.paragraphs.recorded_events() as events:
+            font_size, fitted_text = text_fitting.fit_text(text, style.fontName, font_sizes,
+                                                           width, height,
+                                                           style.leading / style.fontSize,
+                                                           max_lines)
+        paragraph = Paragraph(fitted_text, self.get_sized_style(style, font_size))
+        self.paragraphs.put(cache_key, paragraph, fragment_cache.get_text_size(text) +
+                            PARAGRAPH_SIZE + PARAGRAPH_SIZE_PER_CHARACTER * len(fitted_text),
+                            events)
+        return paragraph
+
+    def get_sized_style(self, style: ParagraphStyle, font_size: float) -> ParagraphStyle:
+        """Get the style in another font size, the leading changes in proportion."""
+        if font_size == style.fontSize:
+            return style
+
+        sized_style = self.sized_styles.get((style.name, font_size))
+        if sized_style is None:
+            sized_style = ParagraphStyle(name=f"{style.name}{font_size}", parent=style,
+                                         fontSize=font_size,
+                                         leading=style.leading * font_size / style.fontSize)
+            self.sized_styles[(style.name, font_size)] = sized_style
+        return sized_style
 
     def load_styles(self):
         """Prepare the different font styles used for the card elements."""
@@ -180,14 +548,6 @@ class Generator:
                                                      fontName=standard_font_bold, fontSize=18,
                                                      alignment=0, textColor=reportlab_colors.white)
 
-        large_rank_style = ParagraphStyle(name=self.LARGE_RANK_STYLE,
-                                          fontName=standard_font_bold, fontSize=12.3,
-                                          alignment=0)
-
-        large_rank_style_unassigned = ParagraphStyle(name=self.LARGE_RANK_STYLE_UNASSIGNED,
-                                                     fontName=standard_font_bold, fontSize=13,
-                                                     alignment=0, textColor=reportlab_colors.white)
-
         summary_style = ParagraphStyle(name="summary", fontName=standard_font_bold,
                                        fontSize=22, alignment=0, leading=22)
 
@@ -197,37 +557,119 @@ class Generator:
         processor_style = ParagraphStyle(name="processor", fontName=standard_font_bold,
                                          fontSize=20, alignment=0)
 
-        small_processor_style = ParagraphStyle(name="smallProcessor", fontName=standard_font_bold,
-                                               fontSize=15, alignment=0)
-
         label_style = ParagraphStyle(name="label", fontName=standard_font,
                                      fontSize=12, alignment=0, leftIndent=0)
 
         self.styles[self.FIRST_LINE] = first_line_style
         self.styles[self.FIRST_LINE_UNASSIGNED] = first_line_style_unassigned
-        self.styles[self.LARGE_RANK_STYLE] = large_rank_style
-        self.styles[self.LARGE_RANK_STYLE_UNASSIGNED] = large_rank_style_unassigned
         self.styles["summary"] = summary_style
 
         self.styles["description"] = description_style
         self.styles["processor"] = processor_style
-        self.styles["smallProcessor"] = small_processor_style
         self.styles["label"] = label_style
+        # assignee and sized styles refer to the styles above, so they have to be computed again
+        self.sized_styles = {}
+        self.assignee_styles = {}
 
     def get_new_card_position(self, canvas: pdf_canvas.Canvas):
-        """Get the position for the next card so four cards fit on a page."""
-        if self.frame_count == 1:
-            self.frame_count += 1
-            self.start_x += 410
-        elif self.frame_count == 2:
-            self.frame_count += 1
-            self.start_x = 10
-            self.start_y = 75
-        elif self.frame_count == 3:
-            self.frame_count += 1
-            self.start_x += 410
-        elif self.frame_count == 4:
-            self.frame_count = 1
-            self.start_x = 10
-            self.start_y = 325
+        """Move on to the next position of the layout, starting a new page once it is full."""
+        self.card_index += 1
+        if self.card_index == self.layout.cards_per_page:
+            self.finish_page(canvas)
+
+    def finish_page(self, canvas: pdf_canvas.Canvas):
+        """Emit the current page, followed by a page with the back sides in duplex layouts."""
+        canvas.showPage()
+        profiling.count("pagesEmitted")
+
+        if self.layout.duplex:
+            for position, entry in zip(self.layout.back_positions, self.page_entries):
+                self.build_back_for_entry(canvas, entry, position)
             canvas.showPage()
+            profiling.count("pagesEmitted")
+
+        self.card_index = 0
+        self.page_entries = []
+
+
+def render_part(entries: Iterable[Card], output_path: str,
+                used_colors: dict[str, tuple[float, float, float]], layout: Layout,
+                compress: bool = True, paragraphs: fragment_cache.FragmentCache = None):
+    """Render a chunk of entries with the given assignee colors - runs in a worker process.
+    Parts rendered in this process can share the paragraph cache of the calling generator."""
+    creator = Generator(layout, compress)
+    creator.used_colors = dict(used_colors)
+    if paragraphs is not None:
+        creator.paragraphs = paragraphs
+    creator.create_pdf(entries, output_path)
+
+
+def render_part_in_worker(entries: Iterable[Card], output_path: str,
+                          used_colors: dict[str, tuple[float, float, float]], layout: Layout,
+                          compress: bool, profile: bool) -> dict:
+    """Render a chunk in a worker process and return its profile, if profiling is enabled."""
+    if profile:
+        profiling.enable()
+    render_part(entries, output_path, used_colors, layout, compress)
+    return profiling.snapshot()
+
+
+def render_parts(parts: list[tuple[list[Card], str]],
+                 used_colors: dict[str, tuple[float, float, float]], layout: Layout,
+                 compress: bool, workers: int, paragraphs: fragment_cache.FragmentCache = None):
+    """Render each (entries, output path) pair, in a process pool if there are several workers.
+    Every part is written to a temporary file first and only moved to its path once complete.
+    The paragraph cache is only used without workers, worker processes don't share it."""
+    temporary_paths = [output_path + ".tmp" for _, output_path in parts]
+    part_entries = [entries for entries, _ in parts]
+
+    if workers > 1:
+        # columns of strings are pickled with less overhead than one object per card
+        part_entries = [card_record.CardBatch(entries) for entries in part_entries]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            snapshots = executor.map(render_part_in_worker, part_entries, temporary_paths,
+                                     [used_colors] * len(parts), [layout] * len(parts),
+                                     [compress] * len(parts),
+                                     [profiling.is_enabled()] * len(parts))
+            for snapshot in snapshots:
+                profiling.merge(snapshot)
+    else:
+        for entries, temporary_path in zip(part_entries, temporary_paths):
+            render_part(entries, temporary_path, used_colors, layout, compress, paragraphs)
+
+    for temporary_path, (_, output_path) in zip(temporary_paths, parts):
+        os.replace(temporary_path, output_path)
+
+
+def get_part_path(output_path: str, part_number: int) -> str:
+    """Get the path of a numbered part of the output pdf."""
+    return f"{output_path[:-4]}_part{part_number}.pdf"
+
+
+def get_name_hash(name: str) -> int:
+    """Get a number for a name that is the same in every run and process, unlike hash()."""
+    return zlib.crc32(name.encode("utf-8"))
+
+
+def merge_pdfs(part_paths: list[str], output_path: str) -> int:
+    """Merge the given pdf files into one file, keeping their order. Every part brings its own
+    copy of the card template and fonts, identical copies are merged into one again, so the
+    template is stored once per document. Returns the page count."""
+    try:
+        from pypdf import PdfWriter
+    except ImportError as error:
+        raise ImportError('Merging pdf files requires pypdf - install with "pip install pypdf"') \
+            from error
+
+    with profiling.stage("merge"):
+        writer = PdfWriter()
+        for part_path in part_paths:
+            writer.append(part_path)
+        # added in pypdf 4.3, older versions write every copy
+        if hasattr(writer, "compress_identical_objects"):
+            for _ in range(MERGE_PASSES):
+                writer.compress_identical_objects()
+
+        with open(output_path, "wb") as output_file:
+            writer.write(output_file)
+    return len(writer.pages)
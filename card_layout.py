@@ -0,0 +1,73 @@
+"""Computes where cards are placed on a page. A layout is built once per run from the paper
+size, the number of cards per page, margins and gutter, card_generator.py then only looks up
+the position of each card. Doesn't depend on reportlab, so the command line can use it
+without loading reportlab."""
+import math
+
+POINTS_PER_CM = 72 / 2.54
+CARD_WIDTH = 14.5 * POINTS_PER_CM
+CARD_HEIGHT = 8.5 * POINTS_PER_CM
+# portrait sizes in points
+PAPER_SIZES = {"A4": (21.0 * POINTS_PER_CM, 29.7 * POINTS_PER_CM),
+               "A3": (29.7 * POINTS_PER_CM, 42.0 * POINTS_PER_CM),
+               "Letter": (612.0, 792.0)}
+# columns, rows and whether the page is landscape for each supported number of cards per page
+GRIDS = {2: (1, 2, False),
+         4: (2, 2, True),
+         6: (2, 3, False),
+         8: (2, 4, False)}
+DEFAULT_PAPER = "A4"
+DEFAULT_CARDS_PER_PAGE = 4
+# minimum distance between the cards and the paper edge, most printers can't print closer
+MARGIN = 8
+# cards already have a padding of their own, so they can be placed right next to each other
+GUTTER = 0
+
+
+class Layout:
+    """Position table for the cards of a page. Cards are scaled to the largest size that fits
+    the grid, rounded down to whole percents, and the grid is centered on the page.
+
+    With duplex, every page of cards is followed by a page for the back sides. Their columns
+    are mirrored, so each back side ends up behind its card when the paper is turned over its
+    left or right edge."""
+
+    def __init__(self, cards_per_page: int = DEFAULT_CARDS_PER_PAGE, paper: str = DEFAULT_PAPER,
+                 duplex: bool = False, margin: float = MARGIN, gutter: float = GUTTER):
+        if cards_per_page not in GRIDS:
+            raise ValueError(f"Unsupported number of cards per page: {cards_per_page}, "
+                             f"use one of {sorted(GRIDS)}")
+        if paper not in PAPER_SIZES:
+            raise ValueError(f"Unsupported paper: {paper}, use one of {sorted(PAPER_SIZES)}")
+
+        columns, rows, landscape = GRIDS[cards_per_page]
+        width, height = PAPER_SIZES[paper]
+        if landscape:
+            width, height = height, width
+
+        self.cards_per_page = cards_per_page
+        self.paper = paper
+        self.duplex = duplex
+        self.page_size = (width, height)
+
+        fitting_scale = min((width - 2 * margin - (columns - 1) * gutter) / columns / CARD_WIDTH,
+                            (height - 2 * margin - (rows - 1) * gutter) / rows / CARD_HEIGHT)
+        self.scale = math.floor(fitting_scale * 100) / 100
+        if self.scale <= 0:
+            raise ValueError("The cards don't fit on the page with these margins")
+
+        card_width = CARD_WIDTH * self.scale
+        card_height = CARD_HEIGHT * self.scale
+        left = (width - columns * card_width - (columns - 1) * gutter) / 2
+        top = (height + rows * card_height + (rows - 1) * gutter) / 2
+
+        column_positions = [left + column * (card_width + gutter) for column in range(columns)]
+        row_positions = [top - (row + 1) * card_height - row * gutter for row in range(rows)]
+
+        # lower left corners, from left to right and top to bottom
+        self.positions = [(x, y) for y in row_positions for x in column_positions]
+        self.back_positions = [(x, y) for y in row_positions for x in reversed(column_positions)]
+
+    def get_key(self) -> str:
+        """Describe the layout, so pages rendered with different layouts can be told apart."""
+        return f"{self.cards_per_page}-up {self.paper}{' duplex' if self.duplex else ''}"
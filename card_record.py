@@ -0,0 +1,93 @@
+"""Compact records for the values shown on a card. xml_parser creates Card records and
+card_generator.Generator renders them - plain dictionaries with the same keys are still
+accepted and converted with as_card."""
+import sys
+from typing import Iterable, Iterator, Union
+
+FIELDS = ("key", "summary", "assignee", "description", "priority", "rank")
+
+
+class Card:
+    """The values of one backlog item. Uses slots instead of a dictionary per item and
+    shares repeated assignee and priority strings, which keeps large exports small."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, key: str, summary: str, assignee: str, description: str,
+                 priority: str, rank: str):
+        self.key = key
+        self.summary = summary
+        self.assignee = sys.intern(assignee)
+        self.description = description
+        self.priority = sys.intern(priority)
+        self.rank = rank
+
+    @classmethod
+    def from_dict(cls, entry: dict[str, str]) -> "Card":
+        """Create a card from a dictionary, the description is optional."""
+        return cls(entry["key"], entry["summary"], entry["assignee"], entry.get("description", ""),
+                   entry["priority"], entry["rank"])
+
+    def to_dict(self) -> dict[str, str]:
+        """Get the values as a dictionary."""
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def keys(self) -> tuple[str, ...]:
+        """Get the field names, so cards can be used like dictionaries."""
+        return FIELDS
+
+    def items(self) -> list[tuple[str, str]]:
+        """Get (field, value) pairs, like dict.items."""
+        return [(field, getattr(self, field)) for field in FIELDS]
+
+    def __getitem__(self, field: str) -> str:
+        if field not in FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field: str, default: str = None) -> str:
+        """Get a value by its field name, like dict.get."""
+        return getattr(self, field) if field in FIELDS else default
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.items() == other.items()
+
+    def __repr__(self) -> str:
+        return f"Card({', '.join(f'{field}={value!r}' for field, value in self.items())})"
+
+
+class CardBatch:
+    """Column-wise storage for many cards, with one list per field instead of one object per
+    card. Iterating creates the Card records on the fly, one at a time."""
+
+    __slots__ = ("columns",)
+
+    def __init__(self, cards: Iterable[Union[Card, dict[str, str]]] = ()):
+        self.columns = {field: [] for field in FIELDS}
+        for card in cards:
+            self.append(card)
+
+    def append(self, card: Union[Card, dict[str, str]]):
+        """Add a card, dictionaries are converted first."""
+        card = as_card(card)
+        for field in FIELDS:
+            self.columns[field].append(getattr(card, field))
+
+    def __len__(self) -> int:
+        return len(self.columns["key"])
+
+    def __getitem__(self, index: int) -> Card:
+        return Card(*(self.columns[field][index] for field in FIELDS))
+
+    def __iter__(self) -> Iterator[Card]:
+        for values in zip(*(self.columns[field] for field in FIELDS)):
+            yield Card(*values)
+
+
+def as_card(entry: Union[Card, dict[str, str]]) -> Card:
+    """Return the entry as Card record, converting dictionaries if needed."""
+    if isinstance(entry, Card):
+        return entry
+    return Card.from_dict(entry)
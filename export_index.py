@@ -0,0 +1,96 @@
+"""Sidecar index of the items of a Jira xml export. For every item it stores where the item
+starts in the file, how many bytes it has and the values filters look at, so reprinting a few
+cards from the same export reads just their items. The index is stored next to the export
+and is only used while the size and modification time of the export are unchanged."""
+import json
+import os
+import re
+from typing import Iterator, Optional
+
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+ITEM_START = re.compile(rb"<item[\s>]")
+ITEM_END = b"</item>"
+CHUNK_SIZE = 4 * 1024 * 1024
+ENCODING_PATTERN = re.compile(rb"""<\?xml[^>]*encoding=["']([\w.-]+)["']""")
+
+
+def get_index_path(file_path: str) -> str:
+    """Get the path of the index of an export, right next to it."""
+    return file_path + INDEX_SUFFIX
+
+
+def get_source_state(file_path: str) -> list[int]:
+    """Get the size and modification time of the export, an index is only valid for these."""
+    status = os.stat(file_path)
+    return [status.st_size, status.st_mtime_ns]
+
+
+def load_index(file_path: str) -> Optional[list[list]]:
+    """Get the item records of the export's index, or None if there is no valid index."""
+    try:
+        with open(get_index_path(file_path), encoding="utf-8") as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return None
+
+    if index.get("version") != INDEX_VERSION or index.get("source") != get_source_state(file_path):
+        return None
+    return index["items"]
+
+
+def save_index(file_path: str, records: list[list], source_state: list[int]):
+    """Write the index of an export. The state of the export has to be taken before it is read,
+    so changes made while it was read make the index invalid."""
+    index_path = get_index_path(file_path)
+    temporary_path = index_path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as index_file:
+        json.dump({"version": INDEX_VERSION, "source": source_state, "items": records},
+                  index_file, separators=(",", ":"))
+    os.replace(temporary_path, index_path)
+
+
+def can_be_indexed(file_path: str) -> bool:
+    """Check if items can be read on their own, which needs the export to be UTF-8 encoded."""
+    with open(file_path, "rb") as export_file:
+        start = export_file.read(200)
+    match = ENCODING_PATTERN.match(start.lstrip(b"\xef\xbb\xbf"))
+    return match is None or match.group(1).lower() in (b"utf-8", b"utf8")
+
+
+def iter_item_bytes(file_path: str) -> Iterator[tuple[int, bytes]]:
+    """Yield the position and the bytes of each item element. Items are found by their tags,
+    which is safe as Jira escapes all markup inside of them."""
+    with open(file_path, "rb") as export_file:
+        buffer = b""
+        buffer_offset = 0
+        while True:
+            chunk = export_file.read(CHUNK_SIZE)
+            buffer += chunk
+            index = 0
+            while True:
+                start_match = ITEM_START.search(buffer, index)
+                if start_match is None:
+                    # keep the end in case an item tag starts in it
+                    index = max(index, len(buffer) - len(ITEM_END))
+                    break
+                end = buffer.find(ITEM_END, start_match.start())
+                if end == -1:
+                    index = start_match.start()
+                    break
+                end += len(ITEM_END)
+                yield buffer_offset + start_match.start(), buffer[start_match.start():end]
+                index = end
+
+            if not chunk:
+                return
+            buffer = buffer[index:]
+            buffer_offset += index
+
+
+def read_items(file_path: str, records: list[list]) -> Iterator[bytes]:
+    """Read the bytes of the items of the given index records."""
+    with open(file_path, "rb") as export_file:
+        for record in records:
+            export_file.seek(record[0])
+            yield export_file.read(record[1])
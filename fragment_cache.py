@@ -0,0 +1,144 @@
+"""Memoizes the work done for values that come up again and again - priorities, assignees,
+rank formats and description boilerplate. xml_parser.py keeps the sanitized strings and
+card_generator.py the laid out paragraphs of card cells. Both caches are limited in size and
+drop their least recently used values first. They can be saved to a file and loaded again
+by the next run, so unchanged cards of a daily export cost almost nothing. The caches are
+disabled unless --fragment-cache is given, so memory use doesn't grow with the export."""
+import collections
+import contextlib
+import os
+import pickle
+import sys
+import tempfile
+
+import profiling
+
+FORMAT_VERSION = 2
+_NOT_RECORDING = contextlib.nullcontext(())
+
+
+class FragmentCache:
+    """Values by key, up to a total size in bytes. The size of each value is estimated by the
+    caller. Hits and misses are counted, also as profiling events named after the cache.
+
+    The profiling events counted while a value was created are stored with it and counted
+    again on every hit, so the profile counts events rather than distinct values. A cache with
+    a maximum size of 0 is disabled, it stores nothing and counts neither hits nor misses."""
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        # key: (value, size, events), the least recently used key first
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def is_enabled(self) -> bool:
+        """Check if the cache stores values at all."""
+        return self.max_bytes > 0
+
+    def resize(self, max_bytes: int):
+        """Change the maximum size, 0 disables the cache and drops all values."""
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def get(self, key, default=None):
+        """Get the value for the key and mark it as recently used. The events recorded with the
+        value are counted again."""
+        if not self.max_bytes:
+            return default
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            profiling.count(f"{self.name}Misses")
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        profiling.count(f"{self.name}Hits")
+        for event, amount in entry[2]:
+            profiling.count(event, amount)
+        return entry[0]
+
+    def recorded_events(self):
+        """Context manager collecting the events counted while a value is created, to be passed
+        to put. Nothing is recorded while the cache is disabled."""
+        if not self.max_bytes:
+            return _NOT_RECORDING
+        return profiling.recorded_events()
+
+    def put(self, key, value, size: int, events=()):
+        """Store a value with the events counted while it was created, dropping the least
+        recently used values while the cache is too large. Values larger than the whole cache
+        are not stored."""
+        if size > self.max_bytes:
+            return
+        old_entry = self.entries.pop(key, None)
+        if old_entry is not None:
+            self.bytes -= old_entry[1]
+
+        self.entries[key] = (value, size, tuple(dict(events).items()))
+        self.bytes += size
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used values until the cache is within its size."""
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all values, the statistics are kept."""
+        self.entries.clear()
+        self.bytes = 0
+
+    def get_stats(self) -> dict:
+        """Get the size and the hit and miss counts as a JSON compatible dictionary."""
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions}
+
+
+def get_text_size(*texts: str) -> int:
+    """Estimate the memory used by some strings."""
+    return sum(sys.getsizeof(text) for text in texts)
+
+
+def load(file_path: str, caches: list[FragmentCache], version: str) -> bool:
+    """Fill the caches with the values saved by an earlier run. Nothing is loaded if the file
+    doesn't exist or was saved by another version, returns whether values were loaded.
+
+    The file is read with pickle, so only files written by save should be loaded."""
+    try:
+        with open(file_path, "rb") as cache_file:
+            saved = pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return False
+    if not isinstance(saved, dict) or saved.get("format") != FORMAT_VERSION or \
+            saved.get("version") != version:
+        return False
+
+    for cache in caches:
+        for key, (value, size, events) in saved["caches"].get(cache.name, []):
+            cache.put(key, value, size, events)
+    return True
+
+
+def save(file_path: str, caches: list[FragmentCache], version: str):
+    """Write the values of the caches, from the least to the most recently used one. The
+    version describes everything the values depend on, e.g. the reportlab version."""
+    # several processes of a batch may save at the same time, each one writes its own file
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(file_path)),
+                                     suffix=".tmp", delete=False) as cache_file:
+        pickle.dump({"format": FORMAT_VERSION,
+                     "version": version,
+                     "caches": {cache.name: list(cache.entries.items()) for cache in caches}},
+                    cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_file.name, file_path)
@@ -0,0 +1,235 @@
+"""Readers for exports other than Jira's xml: the JSON response of the Jira REST search and
+Jira's CSV export. Each reader yields the raw values of one backlog item at a time, in the
+order of card_record.FIELDS, and xml_parser.py sanitizes them like the values of xml items.
+Values in these formats are plain text, so they are escaped to markup here."""
+import csv
+import html
+import json
+import os
+import re
+from typing import Iterator, TextIO
+
+UNASSIGNED = "Unassigned"
+DEFAULT_RANK = "0"
+# the rank custom field has a different id in every Jira instance, LexoRank values are
+# recognized by their format if the response doesn't contain the field names
+LEXO_RANK_PATTERN = re.compile(r"\d+\|[0-9a-z]+:[0-9a-z]*")
+CHUNK_SIZE = 64 * 1024
+# possible CSV column names for each field, compared case insensitively
+CSV_COLUMNS = {"key": ("issue key", "key"),
+               "summary": ("summary",),
+               "assignee": ("assignee",),
+               "description": ("description",),
+               "priority": ("priority",),
+               "rank": ("custom field (rank)", "rank")}
+
+
+def iter_values_from_json(file_path: str) -> Iterator[tuple[str, ...]]:
+    """Read a saved response of the Jira REST search (/rest/api/2/search or 3) and yield the
+    values of each issue. Issues are decoded one at a time, the file is never loaded whole.
+
+    The field names tell which field holds the rank, but Jira puts them after the issues. Issues
+    read before the names are kept until the names are known, which is at most one page of
+    search results."""
+    rank_field = None
+    names_read = False
+    waiting_issues = []
+    with open(file_path, encoding="utf-8") as json_file:
+        for name, value in iter_json_object(json_file, "issues"):
+            if name == "names":
+                # present if the search was made with expand=names
+                rank_field = next((field for field, field_name in value.items()
+                                   if field_name == "Rank"), rank_field)
+                names_read = True
+                for issue in waiting_issues:
+                    yield get_values_from_issue(issue, rank_field)
+                waiting_issues.clear()
+            elif name == "issues":
+                if names_read:
+                    yield get_values_from_issue(value, rank_field)
+                else:
+                    waiting_issues.append(value)
+
+    # the search was made without expand=names
+    for issue in waiting_issues:
+        yield get_values_from_issue(issue, rank_field)
+
+
+def iter_json_object(json_file: TextIO, streamed_name: str,
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[tuple[str, object]]:
+    """Yield (name, value) for each member of the top level object of a JSON file. Values of
+    the streamed member are expected to be an array, which is yielded element by element."""
+    reader = JsonReader(json_file, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        name = reader.read_value()
+        reader.expect(":")
+        if name == streamed_name and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() != "]":
+                while True:
+                    yield name, reader.read_value()
+                    if reader.read_separator("]"):
+                        break
+            else:
+                reader.expect("]")
+        else:
+            yield name, reader.read_value()
+
+        if reader.read_separator("}"):
+            return
+
+
+class JsonReader:
+    """Decodes JSON values one after another from a file that is read in chunks."""
+
+    WHITESPACE = " \t\r\n"
+
+    def __init__(self, json_file: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.json_file = json_file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.index = 0
+        self.at_end = False
+
+    def read_more(self) -> bool:
+        """Append the next chunk of the file to the buffer, returns False at the end."""
+        chunk = self.json_file.read(self.chunk_size)
+        self.buffer = self.buffer[self.index:] + chunk
+        self.index = 0
+        self.at_end = not chunk
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """Get the next character that is not whitespace, without consuming it."""
+        while True:
+            while self.index < len(self.buffer) and self.buffer[self.index] in self.WHITESPACE:
+                self.index += 1
+            if self.index < len(self.buffer):
+                return self.buffer[self.index]
+            if not self.read_more():
+                raise ValueError("Unexpected end of JSON file")
+
+    def expect(self, character: str):
+        """Consume the given character, which has to come next."""
+        if self.peek() != character:
+            raise ValueError(f"Expected {character!r} in JSON file, found {self.peek()!r}")
+        self.index += 1
+
+    def read_separator(self, closing: str) -> bool:
+        """Consume a comma or the closing bracket, returns True for the closing bracket."""
+        if self.peek() == closing:
+            self.index += 1
+            return True
+        self.expect(",")
+        return False
+
+    def read_value(self):
+        """Decode the next value, reading more of the file until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.index)
+                # a number at the end of the buffer might continue in the next chunk
+                if end < len(self.buffer) or self.at_end:
+                    self.index = end
+                    return value
+            except json.JSONDecodeError:
+                if self.at_end:
+                    raise
+            self.read_more()
+
+
+def get_values_from_issue(issue: dict, rank_field: str = None) -> tuple[str, ...]:
+    """Get the values of an issue of a REST search response."""
+    fields = issue.get("fields") or {}
+    assignee = fields.get("assignee")
+    priority = fields.get("priority")
+
+    if rank_field is not None:
+        rank = fields.get(rank_field) or DEFAULT_RANK
+    else:
+        rank = next((value for field, value in fields.items()
+                     if field.startswith("customfield_") and isinstance(value, str)
+                     and LEXO_RANK_PATTERN.fullmatch(value)), DEFAULT_RANK)
+
+    return (escape(issue.get("key")),
+            escape(fields.get("summary")),
+            escape(assignee.get("displayName")) if assignee else UNASSIGNED,
+            escape(get_description_text(fields.get("description"))),
+            escape(priority.get("name")) if priority else "",
+            escape(str(rank)))
+
+
+def escape(value: str) -> str:
+    """Turn a plain text value into markup, None becomes an empty string."""
+    return html.escape(value, quote=False) if value else ""
+
+
+def get_description_text(description) -> str:
+    """Get the description as plain text. Version 2 of the REST API returns text already,
+    version 3 a document of nested nodes whose texts are joined, one line for each block."""
+    if isinstance(description, dict):
+        return "\n".join(get_document_blocks(description))
+    return description
+
+
+def get_document_blocks(node: dict) -> Iterator[str]:
+    """Yield the text of each paragraph, heading or other block of a document node."""
+    children = node.get("content") or []
+    if any(child.get("type") in ("text", "hardBreak") for child in children):
+        yield "".join("\n" if child.get("type") == "hardBreak" else child.get("text", "")
+                      for child in children)
+        return
+    for child in children:
+        yield from get_document_blocks(child)
+
+
+def iter_values_from_csv(file_path: str) -> Iterator[tuple[str, ...]]:
+    """Read a CSV export of Jira issues row by row and yield the values of each issue."""
+    with open(file_path, encoding="utf-8-sig", newline="") as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = get_csv_columns(header)
+
+        for row in reader:
+            if not row:
+                continue
+            values = {field: escape(row[column]) if column is not None and column < len(row)
+                      else "" for field, column in columns.items()}
+            yield (values["key"],
+                   values["summary"],
+                   values["assignee"] or UNASSIGNED,
+                   values["description"],
+                   values["priority"],
+                   values["rank"] or DEFAULT_RANK)
+
+
+def get_csv_columns(header: list[str]) -> dict[str, int]:
+    """Find the column of each field, None for fields the export doesn't contain. Jira repeats
+    some columns, the first one is used."""
+    positions = {}
+    for position, column_name in enumerate(header):
+        positions.setdefault(column_name.strip().lower(), position)
+
+    columns = {field: next((positions[name] for name in names if name in positions), None)
+               for field, names in CSV_COLUMNS.items()}
+    if columns["key"] is None:
+        raise ValueError("The CSV file has no issue key column")
+    return columns
+
+
+# readers for each file extension, xml files are read by xml_parser.py itself
+READERS = {".json": iter_values_from_json,
+           ".csv": iter_values_from_csv}
+
+
+def get_reader(file_path: str):
+    """Get the reader for the extension of the file, or None if it is a Jira xml export."""
+    return READERS.get(os.path.splitext(file_path)[1].lower())
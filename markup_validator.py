@@ -0,0 +1,46 @@
+"""Checks whether strings are valid Reportlab paragraph markup, so card fields can be escaped
+before they break card generation. Results are cached, as the same values (assignees,
+priorities, ranks) show up on many cards. Reportlab is only imported for values that
+actually contain markup."""
+import functools
+import html
+
+import profiling
+
+MARKUP_CHARACTERS = ('<', '>', '&')
+
+
+@functools.lru_cache(maxsize=1)
+def get_validation_style():
+    """Get the style used for validation, reportlab is only imported once it is needed."""
+    from reportlab.lib.styles import getSampleStyleSheet
+    return getSampleStyleSheet()['BodyText']
+
+
+@functools.lru_cache(maxsize=4096)
+def is_valid_markup(string: str) -> bool:
+    """Check if Reportlab can parse the string as the text of a paragraph."""
+    # plain text without any markup characters can always be used as is
+    if not any(character in string for character in MARKUP_CHARACTERS):
+        return True
+
+    # this runs the same parser a Paragraph uses, but skips creating the Paragraph itself
+    from reportlab.platypus.paragraph import cleanBlockQuotedText
+    from reportlab.platypus.paraparser import ParaParser
+
+    parser = ParaParser()
+    parser.caseSensitive = 1
+    try:
+        _, fragments, _ = parser.parse(cleanBlockQuotedText(string), get_validation_style())
+    except (ValueError, OSError):
+        # images that can't be loaded raise an OSError and would crash rendering as well
+        return False
+    return fragments is not None
+
+
+def escape_if_invalid(string: str) -> str:
+    """Return the string unchanged if it is valid markup, otherwise return it escaped."""
+    if is_valid_markup(string):
+        return string
+    profiling.count("escapeFallbacks")
+    return html.escape(string)
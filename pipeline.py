@@ -0,0 +1,127 @@
+"""Runs parsing and rendering at the same time. A producer, in a thread or a separate process,
+reads the export and puts batches of sanitized entries into a bounded queue, while the
+renderer takes them out again. A full queue makes the producer wait, so no more than the
+queue size of batches is held in memory, no matter how far the parser is ahead."""
+import multiprocessing
+import queue
+import threading
+from typing import Callable, Iterable, Iterator
+
+import card_record
+import profiling
+
+MODES = ("thread", "process")
+DEFAULT_QUEUE_SIZE = 16
+# entries are passed in batches, one queue operation per entry would cost more than it saves
+BATCH_SIZE = 64
+# how long a blocked producer waits before checking if the consumer has stopped
+PUT_TIMEOUT = 0.1
+_END = "end"
+
+
+class ProducerError:
+    """Wraps an exception raised by the producer, so it is raised again by the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def iter_pipelined(produce: Callable[..., Iterable], arguments: tuple, mode: str = "thread",
+                   queue_size: int = DEFAULT_QUEUE_SIZE,
+                   batch_size: int = BATCH_SIZE) -> Iterator[card_record.Card]:
+    """Yield the entries of produce(*arguments), which runs in a thread or a process. In process
+    mode, produce has to be a module level function, so it can be sent to the process.
+
+    Stopping early, e.g. because rendering failed, stops the producer as well."""
+    if mode not in MODES:
+        raise ValueError(f"Unsupported pipeline mode: {mode}, use one of {list(MODES)}")
+
+    if mode == "process":
+        context = multiprocessing.get_context("spawn")
+        entry_queue = context.Queue(queue_size)
+        stop_event = context.Event()
+        producer = context.Process(target=produce_batches, daemon=True,
+                                   args=(produce, arguments, entry_queue, stop_event, batch_size,
+                                         profiling.is_enabled()))
+    else:
+        entry_queue = queue.Queue(queue_size)
+        stop_event = threading.Event()
+        # the thread shares the profile of this process, so it doesn't need one of its own
+        producer = threading.Thread(target=produce_batches, daemon=True,
+                                    args=(produce, arguments, entry_queue, stop_event, batch_size,
+                                          False))
+
+    producer.start()
+    try:
+        while True:
+            with profiling.stage("waitForEntries"):
+                batch = get_batch(entry_queue, producer)
+            if isinstance(batch, ProducerError):
+                raise batch.error
+            if isinstance(batch, dict):
+                # the profile of the producer process
+                profiling.merge(batch)
+                continue
+            if batch == _END:
+                return
+            yield from batch
+    finally:
+        stop_event.set()
+        producer.join()
+
+
+def get_batch(entry_queue, producer):
+    """Take the next value out of the queue, waiting until there is one. Fails if the producer
+    is gone without putting its end marker, e.g. because its process was killed."""
+    while True:
+        try:
+            return entry_queue.get(timeout=PUT_TIMEOUT)
+        except queue.Empty:
+            if not producer.is_alive() and entry_queue.empty():
+                raise RuntimeError("The parser stopped before all entries were read")
+
+
+def produce_batches(produce: Callable[..., Iterable], arguments: tuple, entry_queue,
+                    stop_event, batch_size: int, profile: bool):
+    """Put batches of the produced entries into the queue, followed by the profile of a
+    producer process and an end marker, or the error that stopped the producer."""
+    if profile:
+        profiling.enable()
+    try:
+        batch = card_record.CardBatch()
+        for entry in produce(*arguments):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                if not put(entry_queue, batch, stop_event):
+                    return
+                batch = card_record.CardBatch()
+
+        if len(batch) and not put(entry_queue, batch, stop_event):
+            return
+        if profile and not put(entry_queue, profiling.snapshot(), stop_event):
+            return
+        put(entry_queue, _END, stop_event)
+    except Exception as error:
+        put(entry_queue, ProducerError(error), stop_event)
+    finally:
+        if stop_event.is_set() and hasattr(entry_queue, "cancel_join_thread"):
+            # nobody reads the queue anymore, so the process must not wait for it to be emptied
+            entry_queue.cancel_join_thread()
+
+
+def put(entry_queue, value, stop_event) -> bool:
+    """Put a value into the queue, waiting while it is full. Returns False if the consumer has
+    stopped in the meantime."""
+    try:
+        entry_queue.put_nowait(value)
+        return True
+    except queue.Full:
+        profiling.count("producerWaits")
+
+    while not stop_event.is_set():
+        try:
+            entry_queue.put(value, timeout=PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
@@ -0,0 +1,136 @@
+"""Lightweight instrumentation for finding out where the time of a generation run goes.
+Modules report stage durations and event counts through the functions of this module.
+Profiling is disabled by default, in which case every hook returns right away."""
+import collections
+import contextlib
+import json
+import threading
+import time
+from typing import Iterable, Iterator
+
+_DISABLED_STAGE = contextlib.nullcontext()
+_profile = None
+# the events counted by each thread inside of recorded_events
+_recording = threading.local()
+
+
+class Profile:
+    """Collects the total wall time of each stage and the number of each event."""
+
+    def __init__(self):
+        self.stage_seconds = collections.defaultdict(float)
+        self.counters = collections.Counter()
+        self.start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Add the time spent in the with block to the given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += time.perf_counter() - start
+
+    def timed(self, iterable: Iterable, name: str) -> Iterator:
+        """Yield from the iterable, adding the time spent producing each value to the stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                self.stage_seconds[name] += time.perf_counter() - start
+                return
+            self.stage_seconds[name] += time.perf_counter() - start
+            yield value
+
+    def merge(self, snapshot: dict):
+        """Add the stages and counters of a snapshot, e.g. one taken in a worker process."""
+        for name, seconds in snapshot["stages"].items():
+            self.stage_seconds[name] += seconds
+        self.counters.update(snapshot["counters"])
+
+    def snapshot(self) -> dict:
+        """Get all collected values as a JSON compatible dictionary."""
+        return {"totalSeconds": round(time.perf_counter() - self.start_time, 6),
+                "stages": {name: round(seconds, 6) for name, seconds in self.stage_seconds.items()},
+                "counters": dict(self.counters)}
+
+
+def enable() -> Profile:
+    """Start collecting into a new profile and return it."""
+    global _profile
+    _profile = Profile()
+    return _profile
+
+
+def disable():
+    """Stop collecting, hooks do nothing afterwards."""
+    global _profile
+    _profile = None
+
+
+def is_enabled() -> bool:
+    """Check if a profile is currently being collected."""
+    return _profile is not None
+
+
+def stage(name: str):
+    """Context manager that adds its duration to the given stage while profiling."""
+    if _profile is None:
+        return _DISABLED_STAGE
+    return _profile.stage(name)
+
+
+def timed(iterable: Iterable, name: str) -> Iterable:
+    """Time producing the values of an iterable, returns the iterable unchanged if disabled."""
+    if _profile is None:
+        return iterable
+    return _profile.timed(iterable, name)
+
+
+def count(event: str, amount: int = 1):
+    """Count an event while profiling, and for recorded_events."""
+    if _profile is not None:
+        _profile.counters[event] += amount
+    recorded_counters = getattr(_recording, "counters", None)
+    if recorded_counters is not None:
+        recorded_counters[event] += amount
+
+
+@contextlib.contextmanager
+def recorded_events() -> Iterator[collections.Counter]:
+    """Collect the events counted in the with block by this thread, also while profiling is
+    disabled. Cached results keep them, so they can be counted again whenever they are reused.
+    Events of nested blocks are recorded by the outer blocks as well."""
+    outer_counters = getattr(_recording, "counters", None)
+    counters = collections.Counter()
+    _recording.counters = counters
+    try:
+        yield counters
+    finally:
+        _recording.counters = outer_counters
+        if outer_counters is not None:
+            outer_counters.update(counters)
+
+
+def merge(snapshot: dict):
+    """Add a snapshot from another process to the current profile."""
+    if _profile is not None and snapshot is not None:
+        _profile.merge(snapshot)
+
+
+def snapshot() -> dict:
+    """Get the values of the current profile, or None if profiling is disabled."""
+    if _profile is None:
+        return None
+    return _profile.snapshot()
+
+
+def write_report(file_path: str, output: dict = None):
+    """Write the current profile as JSON, together with a summary of the written files."""
+    report = snapshot()
+    if output is not None:
+        report["output"] = output
+    with open(file_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
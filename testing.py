@@ -1,7 +1,38 @@
 """Test module for CardGen project."""
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import xml.etree.ElementTree as elementTree
 import xml_parser
+import benchmark
+import card_cache
+import card_filter
 import card_generator
+import card_layout
+import card_record
+import export_index
+import fragment_cache
+import input_adapters
+import markup_validator
+import pipeline
+import profiling
+import text_fitting
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+LEXO_RANK_EXAMPLE = os.path.join(EXAMPLES_DIR, "Example with LexoRank.xml")
+OLD_RANK_EXAMPLE = os.path.join(EXAMPLES_DIR, "Example with Old Ranks.xml")
+# the slow performance tests render thousands of cards, they only run if this is set to 1
+SLOW_TESTS = os.environ.get("CARDGEN_SLOW_TESTS") == "1"
 
 
 class ParserTests(unittest.TestCase):
@@ -44,14 +75,112 @@ class ParserTests(unittest.TestCase):
         """Test trimming of long descriptions."""
         test_string = "A very long description of a very important backlog item" \
                       " that will never fit on the card and has to be trimmed so it does" \
-                      "disrupt the layout. The cut-off point is 160 characters."
+                      "disrupt the layout. The cut-off point is 160 characters." * 4
 
         original_length = len(test_string)
 
         trimmed_description = xml_parser.trim_description(test_string)
         trimmed_length = len(trimmed_description)
         self.assertLess(trimmed_length, original_length)
-        self.assertLess(trimmed_length, 165)
+        self.assertLess(trimmed_length, xml_parser.MAX_DESCRIPTION_LENGTH + 5)
+
+    def test_description_sanitizing_matches_single_steps(self):
+        """Test that the one pass sanitizer gives the same results as the single steps."""
+        test_strings = ["Text<a href=bla></a>moreText",
+                        "Text<a href=bla></a>moreText<a href=www.google.com></a>",
+                        "Text <a name=noHyperLink></a> moreText<a href=importantTag></a>",
+                        "A text \n with \n too \n many \n new \n lines",
+                        "A very long description " * 10]
+
+        for test_string in test_strings:
+            expected_string = xml_parser.remove_link_tags(test_string)
+            expected_string = xml_parser.remove_excessive_new_lines(expected_string)
+            expected_string = xml_parser.trim_description(expected_string)
+            self.assertEqual(expected_string, xml_parser.sanitize_description(test_string))
+
+    def test_description_cut_keeps_markup_valid(self):
+        """Test that trimming never cuts tags or entities and closes open tags."""
+        length = xml_parser.MAX_DESCRIPTION_LENGTH
+        test_string = "<p>" + "x" * (length - 13) + " &amp; <b>bold text that is cut</b></p>"
+        expected_string = "<p>" + "x" * (length - 13) + " &amp; <b>b...</b></p>"
+        self.assertEqual(expected_string, xml_parser.sanitize_description(test_string))
+
+        test_string = "<p>" + "x" * (length - 5) + " &amp; more</p>"
+        expected_string = "<p>" + "x" * (length - 5) + " ...</p>"
+        self.assertEqual(expected_string, xml_parser.sanitize_description(test_string))
+
+        test_string = "<b>one\ntwo\nthree\nfour\nfive</b>"
+        expected_string = "<b>one\ntwo\nthree\nfour</b>"
+        self.assertEqual(expected_string, xml_parser.sanitize_description(test_string))
+
+    def test_unclosed_link_removal(self):
+        """Test that a link without closing tag is removed up to the end of the string."""
+        test_string = "Text<a href=bla>moreText"
+        self.assertEqual("Text <i>link</i> ", xml_parser.remove_link_tags(test_string))
+        self.assertEqual("Text <i>link</i> ", xml_parser.sanitize_description(test_string))
+
+    def test_batch_generation(self):
+        """Test that a batch creates a pdf for every xml file and skips broken files."""
+        with tempfile.TemporaryDirectory() as batch_directory:
+            for example in (LEXO_RANK_EXAMPLE, OLD_RANK_EXAMPLE):
+                shutil.copy(example, batch_directory)
+            broken_path = os.path.join(batch_directory, "broken.xml")
+            with open(broken_path, "w", encoding="utf-8") as broken_file:
+                broken_file.write("<rss><channel>")
+            incomplete_path = os.path.join(batch_directory, "incomplete.xml")
+            with open(incomplete_path, "w", encoding="utf-8") as incomplete_file:
+                incomplete_file.write("<rss><channel><item><key>CG-1</key></item></channel></rss>")
+
+            file_paths = xml_parser.find_input_files(batch_directory)
+            arguments = xml_parser.parse_arguments(["--batch", batch_directory])
+            output_paths = xml_parser.generate_batch(file_paths, arguments)
+
+            self.assertEqual(len(file_paths), 4)
+            self.assertIsNone(output_paths[file_paths.index(broken_path)])
+            self.assertIsNone(output_paths[file_paths.index(incomplete_path)])
+            created_paths = [path for path in output_paths if path is not None]
+            self.assertEqual(len(created_paths), 2)
+            self.assertTrue(all(os.path.exists(path) for path in created_paths))
+
+    def test_own_files_are_not_batch_inputs(self):
+        """Test that a glob for json exports doesn't pick up profiles and indexes."""
+        with tempfile.TemporaryDirectory() as batch_directory:
+            for file_name in ("search.json", "search_profile.json", "export.xml.index.json"):
+                with open(os.path.join(batch_directory, file_name), "w", encoding="utf-8"):
+                    pass
+
+            file_paths = xml_parser.find_input_files(os.path.join(batch_directory, "*.json"))
+        self.assertEqual(file_paths, [os.path.join(batch_directory, "search.json")])
+
+    def test_changed_files(self):
+        """Test that watch mode only picks up files that changed since they were rendered."""
+        with tempfile.TemporaryDirectory() as watch_directory:
+            file_path = shutil.copy(LEXO_RANK_EXAMPLE, watch_directory)
+            pattern = os.path.join(watch_directory, "*.xml")
+
+            changed_files = xml_parser.get_changed_files(pattern, {})
+            self.assertEqual(list(changed_files), [file_path])
+            self.assertEqual(xml_parser.get_changed_files(pattern, changed_files), {})
+
+            os.utime(file_path, (0, 0))
+            self.assertEqual(list(xml_parser.get_changed_files(pattern, changed_files)),
+                             [file_path])
+
+    def test_parsing_does_not_load_reportlab(self):
+        """Test that reading options and plain exports doesn't import reportlab."""
+        check = "import sys, xml_parser; xml_parser.parse_arguments(sys.argv[1:]); " \
+                "xml_parser.summarize_export(sys.argv[1]); sys.exit('reportlab' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", check, LEXO_RANK_EXAMPLE],
+                                cwd=os.path.dirname(EXAMPLES_DIR))
+        self.assertEqual(result.returncode, 0)
+
+    def test_streaming_matches_tree_parsing(self):
+        """Test that streaming parsing yields the same entries as parsing the whole tree."""
+        for example in (LEXO_RANK_EXAMPLE, OLD_RANK_EXAMPLE):
+            expected_entries = xml_parser.get_entries_from_xml(elementTree.parse(example))
+            actual_entries = list(xml_parser.iter_entries_from_file(example))
+
+            self.assertEqual(expected_entries, actual_entries)
 
 
 class GeneratorTests(unittest.TestCase):
@@ -65,35 +194,32 @@ class GeneratorTests(unittest.TestCase):
 
         self.assertEqual(len(actual_colors), 10)
 
-    def test_rank_style_choice(self):
-        """Test correct rank style choice for old rank format."""
+    def test_rank_size_choice(self):
+        """Test that short ranks of the old format keep the full font size."""
         class_under_test = card_generator.Generator()
-        short_rank = "774"
-        assignee = "Meyer, Max"
-        first_line_style = "A first line style"
-
-        rank_style = class_under_test.get_rank_style(short_rank, assignee, first_line_style)
-        self.assertEqual(rank_style, first_line_style)
+        class_under_test.load_styles()
+        first_line_style = class_under_test.styles["firstLine"]
 
-        # repeat with unassigned task, should not matter with a short rank
-        rank_style = class_under_test.get_rank_style(short_rank, class_under_test.UNASSIGNED,
-                                                     first_line_style)
-        self.assertEqual(rank_style, first_line_style)
+        rank = class_under_test.fit_paragraph("774", first_line_style,
+                                              class_under_test.FIRST_LINE_SIZES, 0, 0, max_lines=1)
+        self.assertEqual(rank.style.fontSize, first_line_style.fontSize)
+        self.assertEqual(rank.text, "774")
 
-    def test_rank_style_choice_with_lexo_rank(self):
-        """Test correct rank style choice for new lexo rank format."""
+    def test_rank_size_choice_with_lexo_rank(self):
+        """Test that lexo ranks get a smaller font size, so they fit on one line."""
         class_under_test = card_generator.Generator()
-        assignee = "Meyer, Max"
+        class_under_test.load_styles()
         lexo_rank = "0|hzzzz7:"
-        first_line_style = "firstLine"
 
-        rank_style = class_under_test.get_rank_style(lexo_rank, assignee, first_line_style)
-        self.assertEqual(rank_style, class_under_test.LARGE_RANK_STYLE)
-
-        # repeat with unassigned task
-        rank_style = class_under_test.get_rank_style(lexo_rank, class_under_test.UNASSIGNED,
-                                                     first_line_style)
-        self.assertEqual(rank_style, class_under_test.LARGE_RANK_STYLE_UNASSIGNED)
+        for style_name in ("firstLine", "firstLineUnassigned"):
+            first_line_style = class_under_test.styles[style_name]
+            rank = class_under_test.fit_paragraph(lexo_rank, first_line_style,
+                                                  class_under_test.FIRST_LINE_SIZES, 0, 0,
+                                                  max_lines=1)
+            self.assertLess(rank.style.fontSize, first_line_style.fontSize)
+            self.assertEqual(rank.style.textColor, first_line_style.textColor)
+            rank.wrap(class_under_test.COLUMN_WIDTHS[0] - 12, 1000)
+            self.assertEqual(len(rank.blPara.lines), 1)
 
     def test_color_choice_for_unassigned(self):
         """Test color choice for unassigned items."""
@@ -121,5 +247,884 @@ class GeneratorTests(unittest.TestCase):
         self.assertEqual(chosen_color, hot_pink)
 
 
+    def test_colors_for_many_assignees(self):
+        """Test that every assignee gets a different color, even with more than ten."""
+        class_under_test = card_generator.Generator()
+        class_under_test.load_colors()
+        assignees = [f"Person {number}" for number in range(25)]
+
+        card_colors = [class_under_test.get_card_color(assignee) for assignee in assignees]
+        self.assertEqual(len(set(card_colors)), len(assignees))
+        self.assertNotIn(class_under_test.ROYAL_BLUE, card_colors)
+
+    def test_colors_are_reproducible(self):
+        """Test that the same assignees always get the same colors and styles."""
+        assignee_styles = []
+        for _ in range(2):
+            class_under_test = card_generator.Generator()
+            class_under_test.load_colors()
+            class_under_test.load_styles()
+            assignee_styles.append([class_under_test.get_assignee_style(f"Person {number}")
+                                    for number in range(12)])
+
+        self.assertEqual([style.card_color for style in assignee_styles[0]],
+                         [style.card_color for style in assignee_styles[1]])
+        self.assertIs(class_under_test.get_assignee_style("Person 3"), assignee_styles[1][3])
+
+    def test_colors_do_not_depend_on_order(self):
+        """Test that assignees keep their colors when the backlog is reordered or a new assignee
+        comes first, as long as their names start the search for a color at different places."""
+        assignees = ["Urban, Jenny", "Stark, Niklas", "Meyer, Max", "Koch, Paul"]
+        new_assignee = "Weber, Lena"
+        class_under_test = card_generator.Generator()
+        class_under_test.load_colors()
+        color_count = len(class_under_test.named_colors)
+        self.assertEqual(len({card_generator.get_name_hash(assignee) % color_count
+                              for assignee in assignees + [new_assignee]}), len(assignees) + 1)
+
+        card_colors = []
+        for order in (assignees, assignees[::-1], [new_assignee] + assignees):
+            class_under_test = card_generator.Generator()
+            class_under_test.load_colors()
+            card_colors.append({assignee: class_under_test.get_card_color(assignee)
+                                for assignee in order if assignee in assignees})
+        self.assertEqual(card_colors[0], card_colors[1])
+        self.assertEqual(card_colors[0], card_colors[2])
+
+    def test_reused_generator_keeps_colors_apart(self):
+        """Test that a generator creating several pdfs doesn't give a taken color to another
+        assignee."""
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+        class_under_test = card_generator.Generator()
+        with tempfile.TemporaryDirectory() as output_directory:
+            for name in ("first.pdf", "second.pdf"):
+                class_under_test.create_pdf(entries, os.path.join(output_directory, name))
+                entries = [dict(entry, assignee=f"Other {entry['assignee']}")
+                           for entry in entries]
+
+        card_colors = list(class_under_test.used_colors.values())
+        self.assertEqual(len(card_colors), len(set(card_colors)))
+
+    def test_labels_are_left_to_card_template(self):
+        """Test that label cells are left empty, as the card template already contains them."""
+        class_under_test = card_generator.Generator()
+        class_under_test.load_styles()
+        entry = xml_parser.get_entries_from_xml(elementTree.parse(LEXO_RANK_EXAMPLE))[0]
+
+        assignee_style = class_under_test.get_assignee_style(entry.assignee)
+        table_data = class_under_test.get_table_data(entry, assignee_style)
+        self.assertEqual([row[0] for row in table_data[2:]], [None, None])
+        self.assertTrue(all(row[1] is not None for row in table_data))
+
+    def test_page_chunks(self):
+        """Test that entries are split into chunks of whole pages."""
+        class_under_test = card_generator.Generator()
+        entries = [{"assignee": str(index)} for index in range(30)]
+
+        chunks = class_under_test.split_into_page_chunks(entries, 2)
+        self.assertEqual(sum(chunks, []), entries)
+        for chunk in chunks[:-1]:
+            self.assertEqual(len(chunk) % class_under_test.layout.cards_per_page, 0)
+
+    @unittest.skipUnless(importlib.util.find_spec("pypdf"), "pypdf is not installed")
+    def test_parallel_rendering_matches_serial_rendering(self):
+        """Test that parallel rendering creates the same pages as serial rendering."""
+        from pypdf import PdfReader
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE)) * 5
+
+        with tempfile.TemporaryDirectory() as output_directory:
+            parallel_path = os.path.join(output_directory, "parallel.pdf")
+            parallel_generator = card_generator.Generator()
+            parallel_generator.create_pdf_parallel(entries, parallel_path, 2)
+
+            serial_path = os.path.join(output_directory, "serial.pdf")
+            serial_generator = card_generator.Generator()
+            serial_generator.used_colors = dict(parallel_generator.used_colors)
+            serial_generator.create_pdf(entries, serial_path)
+
+            parallel_pages = [page.extract_text() for page in PdfReader(parallel_path).pages]
+            serial_pages = [page.extract_text() for page in PdfReader(serial_path).pages]
+
+        self.assertEqual(len(serial_pages), 10)
+        self.assertEqual(parallel_pages, serial_pages)
+
+
+    def test_compressed_output(self):
+        """Test that pdfs are compressed by default, as reportlab does, and that the output
+        report shows the sizes."""
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE)) * 3
+        with tempfile.TemporaryDirectory() as output_directory:
+            reports = []
+            for class_under_test in (card_generator.Generator(compress=False),
+                                     card_generator.Generator()):
+                output_path = os.path.join(output_directory, f"{len(reports)}.pdf")
+                class_under_test.create_pdf(entries, output_path)
+                reports.append(class_under_test.get_output_report())
+                with open(output_path, "rb") as output_file:
+                    self.assertEqual(b"/FlateDecode" in output_file.read(), len(reports) == 2)
+
+        self.assertEqual([report["pages"] for report in reports], [6, 6])
+        self.assertLess(reports[1]["bytes"], reports[0]["bytes"] / 2)
+        self.assertEqual(reports[1]["bytesPerPage"], round(reports[1]["bytes"] / 6))
+
+    def test_output_parts(self):
+        """Test that parts have the requested number of pages and stale parts are removed."""
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE)) * 5
+        with tempfile.TemporaryDirectory() as output_directory:
+            output_path = os.path.join(output_directory, "cards.pdf")
+            stale_path = card_generator.get_part_path(output_path, 9)
+            for part_number in range(4, 10):
+                with open(card_generator.get_part_path(output_path, part_number), "wb"):
+                    pass
+
+            class_under_test = card_generator.Generator()
+            part_paths = class_under_test.create_pdf_parts(entries, output_path, 4)
+
+            self.assertEqual([os.path.basename(path) for path in part_paths],
+                             ["cards_part1.pdf", "cards_part2.pdf", "cards_part3.pdf"])
+            self.assertTrue(all(os.path.exists(path) for path in part_paths))
+            self.assertFalse(os.path.exists(card_generator.get_part_path(output_path, 4)))
+            self.assertFalse(os.path.exists(stale_path))
+            self.assertEqual([pages for _, pages, _ in class_under_test.output_files], [4, 4, 2])
+
+
+class BenchmarkTests(unittest.TestCase):
+    """Test class for benchmark.py."""
+
+    def test_synthetic_export(self):
+        """Test that synthetic exports can be read like real Jira exports."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = os.path.join(work_directory, "export.xml")
+            benchmark.write_export(export_path, 12, links=3, assignee_count=3, lexo_rank=False)
+            entries = list(xml_parser.iter_entries_from_file(export_path))
+
+        self.assertEqual(len(entries), 12)
+        self.assertEqual([entry["rank"] for entry in entries], [str(rank) for rank in range(1, 13)])
+        self.assertLessEqual(len({entry["assignee"] for entry in entries}), 4)
+        self.assertTrue(any("<i>link</i>" in entry["description"] for entry in entries))
+
+
+class CardCacheTests(unittest.TestCase):
+    """Test class for card_cache.py."""
+
+    @unittest.skipUnless(importlib.util.find_spec("pypdf"), "pypdf is not installed")
+    def test_only_changed_pages_are_rendered(self):
+        """Test that a second run reuses unchanged pages and reports changed cards."""
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            output_path = os.path.join(cache_directory, "cards.pdf")
+            delta_path = os.path.join(cache_directory, "changes.pdf")
+
+            cache = card_cache.CardCache(cache_directory)
+            changed_cards = card_generator.Generator().create_pdf_cached(entries, output_path, cache)
+            self.assertEqual((cache.hits, cache.misses, changed_cards), (0, 2, 8))
+
+            entries[0] = dict(entries[0], summary="Changed summary")
+            cache = card_cache.CardCache(cache_directory)
+            changed_cards = card_generator.Generator().create_pdf_cached(entries, output_path,
+                                                                         cache, delta_path)
+            self.assertEqual((cache.hits, cache.misses, changed_cards), (1, 1, 1))
+            self.assertTrue(os.path.exists(delta_path))
+
+    @unittest.skipUnless(importlib.util.find_spec("pypdf"), "pypdf is not installed")
+    def test_compressed_pages_are_cached_separately(self):
+        """Test that pages rendered without compression are not reused for compressed output."""
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            output_path = os.path.join(cache_directory, "cards.pdf")
+            for compress in (False, True, True):
+                cache = card_cache.CardCache(cache_directory)
+                card_generator.Generator(compress=compress).create_pdf_cached(entries, output_path,
+                                                                              cache)
+            self.assertEqual((cache.hits, cache.misses), (2, 0))
+            self.assertEqual(len(os.listdir(cache.page_directory)), 4)
+
+    @unittest.skipUnless(importlib.util.find_spec("pypdf"), "pypdf is not installed")
+    def test_merged_pages_share_card_template(self):
+        """Test that the pages merged from the cache share the card template. Reportlab gives
+        the template the fonts of its whole pdf, so there is one copy for each set of fonts."""
+        from pypdf import PdfReader
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE)) * 3
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            output_path = os.path.join(cache_directory, "cards.pdf")
+            card_generator.Generator().create_pdf_cached(entries, output_path,
+                                                         card_cache.CardCache(cache_directory))
+            pages = PdfReader(output_path).pages
+            templates = {page["/Resources"]["/XObject"].raw_get("/FormXob.cardTemplate").idnum
+                         for page in pages}
+            font_sets = {tuple(sorted(page["/Resources"]["/Font"])) for page in pages}
+
+        self.assertEqual(len(pages), 6)
+        self.assertEqual(len(templates), len(font_sets))
+        self.assertLess(len(templates), len(pages))
+
+    def test_eviction(self):
+        """Test that the least recently used pages are removed once the cache is too large."""
+        with tempfile.TemporaryDirectory() as cache_directory:
+            cache = card_cache.CardCache(cache_directory, max_size=10)
+            for modification_time, page_key in enumerate(("old", "new")):
+                page_path = cache.get_page_path(page_key)
+                with open(page_path, "wb") as page_file:
+                    page_file.write(b"12345678")
+                os.utime(page_path, (modification_time, modification_time))
+
+            cache.evict()
+            self.assertFalse(os.path.exists(cache.get_page_path("old")))
+            self.assertTrue(os.path.exists(cache.get_page_path("new")))
+
+
+class CardFilterTests(unittest.TestCase):
+    """Test class for card_filter.py."""
+
+    def test_keys_and_key_ranges(self):
+        """Test that keys are selected by their number, alone or in ranges."""
+        selection = card_filter.CardFilter(keys="12, CG-15-CG-17, 30-20")
+        selected_keys = [key for key in ("CG-11", "CG-12", "CG-15", "CG-17", "CG-18", "CG-25")
+                         if selection.matches(key, "Meyer, Max", "High", "0|hzzzz7:")]
+
+        self.assertEqual(selected_keys, ["CG-12", "CG-15", "CG-17", "CG-25"])
+        with self.assertRaises(ValueError):
+            card_filter.CardFilter(keys="12, twelve")
+
+    def test_rank_ranges(self):
+        """Test that old ranks are compared as numbers and LexoRank values as strings."""
+        old_ranks = card_filter.CardFilter(ranks="9..100")
+        self.assertEqual([rank for rank in ("8", "9", "10", "100", "101")
+                          if old_ranks.matches("CG-1", "", "", rank)], ["9", "10", "100"])
+
+        lexo_ranks = card_filter.CardFilter(ranks="0|hzzzz7:..")
+        self.assertEqual([rank for rank in ("0|hzzzz6:", "0|hzzzz7:", "0|i00000:")
+                          if lexo_ranks.matches("CG-1", "", "", rank)], ["0|hzzzz7:", "0|i00000:"])
+
+    def test_items_are_skipped_before_sanitizing(self):
+        """Test that only selected items are turned into entries."""
+        selection = card_filter.CardFilter(assignees=["meyer, max"], priorities=["High", "Low"])
+        profile = profiling.enable()
+        try:
+            entries = list(xml_parser.iter_entries(LEXO_RANK_EXAMPLE, selection))
+        finally:
+            profiling.disable()
+
+        all_entries = list(xml_parser.iter_entries(LEXO_RANK_EXAMPLE))
+        self.assertEqual(entries, [entry for entry in all_entries
+                                   if entry.assignee == "Meyer, Max"
+                                   and entry.priority in ("High", "Low")])
+        self.assertEqual(profile.counters["itemsParsed"], len(entries))
+        self.assertEqual(profile.counters["itemsSkipped"], len(all_entries) - len(entries))
+
+
+class CardLayoutTests(unittest.TestCase):
+    """Test class for card_layout.py."""
+
+    def test_cards_fit_on_page(self):
+        """Test that cards of every layout are on the page and don't overlap."""
+        for paper in card_layout.PAPER_SIZES:
+            for cards_per_page in card_layout.GRIDS:
+                layout = card_layout.Layout(cards_per_page, paper)
+                card_width = card_layout.CARD_WIDTH * layout.scale
+                card_height = card_layout.CARD_HEIGHT * layout.scale
+                page_width, page_height = layout.page_size
+
+                self.assertEqual(len(set(layout.positions)), cards_per_page)
+                for x, y in layout.positions:
+                    self.assertGreaterEqual(min(x, y), card_layout.MARGIN)
+                    self.assertLessEqual(x + card_width, page_width - card_layout.MARGIN)
+                    self.assertLessEqual(y + card_height, page_height - card_layout.MARGIN)
+                    for other_x, other_y in layout.positions:
+                        if (x, y) != (other_x, other_y):
+                            self.assertTrue(abs(x - other_x) >= card_width - 1e-9 or
+                                            abs(y - other_y) >= card_height - 1e-9)
+
+    def test_default_layout(self):
+        """Test that the default layout keeps four cards of full size on landscape A4."""
+        layout = card_layout.Layout()
+        self.assertEqual(layout.scale, 1)
+        self.assertEqual(len(layout.positions), 4)
+        self.assertGreater(layout.page_size[0], layout.page_size[1])
+
+    def test_back_sides_are_mirrored(self):
+        """Test that back sides are in mirrored columns and get their own pages."""
+        layout = card_layout.Layout(6, "Letter", duplex=True)
+        self.assertEqual(layout.back_positions[0], layout.positions[1])
+        self.assertEqual(layout.back_positions[5], layout.positions[4])
+
+        profiling.enable()
+        try:
+            entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+            with tempfile.TemporaryDirectory() as output_directory:
+                output_path = os.path.join(output_directory, "duplex.pdf")
+                card_generator.Generator(layout).create_pdf(entries, output_path)
+            # eight cards need two pages of cards, each followed by a page of back sides
+            self.assertEqual(profiling.snapshot()["counters"]["pagesEmitted"], 4)
+        finally:
+            profiling.disable()
+
+    def test_unsupported_layout(self):
+        """Test that unsupported layouts are rejected."""
+        self.assertRaises(ValueError, card_layout.Layout, 5)
+        self.assertRaises(ValueError, card_layout.Layout, 4, "B5")
+
+
+class CardRecordTests(unittest.TestCase):
+    """Test class for card_record.py."""
+
+    def test_repeated_values_are_shared(self):
+        """Test that parsed cards share their assignee and priority strings."""
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+        for entry in entries:
+            same_assignee = next(other for other in entries if other.assignee == entry.assignee)
+            self.assertIs(entry.assignee, same_assignee.assignee)
+            same_priority = next(other for other in entries if other.priority == entry.priority)
+            self.assertIs(entry.priority, same_priority.priority)
+
+    def test_dictionaries_are_converted(self):
+        """Test that cards can be created from and used like dictionaries."""
+        entry = {"key": "1", "summary": "Summary", "assignee": "Unassigned", "priority": "High",
+                 "rank": "0|i0000f:"}
+        card = card_record.as_card(entry)
+
+        self.assertEqual(card["summary"], "Summary")
+        self.assertEqual(card.description, "")
+        self.assertEqual(dict(card), dict(entry, description=""))
+        self.assertEqual(card_record.Card.from_dict(card.to_dict()), card)
+        self.assertIs(card_record.as_card(card), card)
+
+    def test_batch_keeps_cards(self):
+        """Test that a columnar batch returns the same cards and can be rendered."""
+        entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+        batch = card_record.CardBatch(entries)
+
+        self.assertEqual(len(batch), len(entries))
+        self.assertEqual(list(batch), entries)
+        self.assertEqual(batch[2], entries[2])
+        with tempfile.TemporaryDirectory() as output_directory:
+            output_path = os.path.join(output_directory, "batch.pdf")
+            card_generator.Generator().create_pdf(batch, output_path)
+            self.assertTrue(os.path.getsize(output_path) > 0)
+
+
+class ExportIndexTests(unittest.TestCase):
+    """Test class for export_index.py."""
+
+    def test_indexed_reading_matches_streaming(self):
+        """Test that the index is created once and then gives the same entries."""
+        selection = card_filter.CardFilter(keys="3-6")
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = os.path.join(work_directory, "export.xml")
+            # a small chunk size puts chunk ends in the middle of items
+            export_index.CHUNK_SIZE, chunk_size = 1000, export_index.CHUNK_SIZE
+            try:
+                benchmark.write_export(export_path, 12, assignee_count=3)
+                expected_entries = list(xml_parser.iter_entries(export_path, selection))
+
+                entries = list(xml_parser.iter_entries(export_path, selection, use_index=True))
+                self.assertEqual(entries, expected_entries)
+                self.assertEqual(len(export_index.load_index(export_path)), 12)
+            finally:
+                export_index.CHUNK_SIZE = chunk_size
+
+            # the second run reads only the selected items through the index
+            entries = list(xml_parser.iter_entries(export_path, selection, use_index=True))
+            self.assertEqual(entries, expected_entries)
+            self.assertEqual([entry.key for entry in entries], ["3", "4", "5", "6"])
+
+    def test_changed_export_is_indexed_again(self):
+        """Test that an index is not used once its export has changed."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = os.path.join(work_directory, "export.xml")
+            benchmark.write_export(export_path, 4)
+            list(xml_parser.iter_entries(export_path, use_index=True))
+            self.assertIsNotNone(export_index.load_index(export_path))
+
+            benchmark.write_export(export_path, 6, seed=1)
+            self.assertIsNone(export_index.load_index(export_path))
+            entries = list(xml_parser.iter_entries(export_path, use_index=True))
+            self.assertEqual(len(entries), 6)
+            self.assertEqual(len(export_index.load_index(export_path)), 6)
+
+
+class FragmentCacheTests(unittest.TestCase):
+    """Test class for fragment_cache.py."""
+
+    def test_least_recently_used_values_are_evicted(self):
+        """Test that the cache stays within its size and counts hits and misses."""
+        cache = fragment_cache.FragmentCache("test", 30)
+        cache.put("a", "first", 10)
+        cache.put("b", "second", 10)
+        cache.put("c", "third", 10)
+        self.assertEqual(cache.get("a"), "first")
+
+        cache.put("d", "fourth", 10)
+        cache.put("e", "too large", 31)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNone(cache.get("e"))
+        self.assertEqual(list(cache.entries), ["c", "a", "d"])
+        self.assertEqual(cache.get_stats(), {"entries": 3, "bytes": 30, "hits": 1, "misses": 2,
+                                             "hitRate": 0.3333, "evictions": 1})
+
+    def test_saved_values_are_loaded_by_same_version(self):
+        """Test that values are loaded from a file written by the same version only."""
+        cache = fragment_cache.FragmentCache("test", 100)
+        cache.put(("value", "High"), "High", 10)
+        with tempfile.TemporaryDirectory() as work_directory:
+            cache_path = os.path.join(work_directory, "fragments.cache")
+            fragment_cache.save(cache_path, [cache], "version 1")
+
+            loaded_cache = fragment_cache.FragmentCache("test", 100)
+            self.assertFalse(fragment_cache.load(cache_path, [loaded_cache], "version 2"))
+            self.assertTrue(fragment_cache.load(cache_path, [loaded_cache], "version 1"))
+            self.assertFalse(fragment_cache.load(cache_path + ".missing", [loaded_cache], "1"))
+
+        self.assertEqual(loaded_cache.get(("value", "High")), "High")
+
+    def test_options_other_processes_can_not_use(self):
+        """Test that the cache file is rejected together with options that sanitize or render
+        in other processes."""
+        for options in (["--workers", "2"], ["--pipeline"]):
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                xml_parser.parse_arguments(["--fragment-cache", "f.cache"] + options + ["x.xml"])
+
+        for options in (["--pipeline", "--pipeline-mode", "thread"], ["--batch", "--workers", "2"]):
+            arguments = xml_parser.parse_arguments(["--fragment-cache", "f.cache"] + options +
+                                                   ["x.xml"])
+            self.assertEqual(arguments.fragment_cache, "f.cache")
+
+    @unittest.skipUnless(importlib.util.find_spec("pypdf"), "pypdf is not installed")
+    def test_paragraphs_are_saved_with_page_cache(self):
+        """Test that pages rendered for the page cache fill the paragraph cache as well."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = shutil.copy(LEXO_RANK_EXAMPLE, work_directory)
+            arguments = xml_parser.parse_arguments([
+                "--profile", "--fragment-cache", os.path.join(work_directory, "fragments.cache"),
+                "--cache", os.path.join(work_directory, "pages"), export_path])
+            xml_parser.generate_cards(export_path, xml_parser.get_output_path(export_path),
+                                      arguments)
+            with open(export_path[:-4] + "_profile.json", encoding="utf-8") as report_file:
+                counters = json.load(report_file)["counters"]
+
+        self.assertGreater(counters["paragraphMisses"], 0)
+        self.assertGreater(counters["paragraphHits"], 0)
+
+    def test_disabled_cache(self):
+        """Test that caches are disabled by default and events are counted again on hits."""
+        self.assertFalse(card_generator.Generator().paragraphs.is_enabled())
+        self.assertFalse(xml_parser.SANITIZED_STRINGS.is_enabled())
+
+        cache = fragment_cache.FragmentCache("test", 0)
+        cache.put("a", "first", 10)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+        cache.resize(100)
+        with cache.recorded_events() as events:
+            profiling.count("linksStripped", 2)
+        cache.put("a", "first", 10, events)
+        profile = profiling.enable()
+        try:
+            self.assertEqual(cache.get("a"), "first")
+            self.assertEqual(cache.get("a"), "first")
+        finally:
+            profiling.disable()
+        self.assertEqual(profile.counters["linksStripped"], 4)
+
+    def test_paragraphs_are_reused(self):
+        """Test that repeated card texts are laid out only once."""
+        generator = card_generator.Generator()
+        generator.paragraphs.resize(card_generator.MAX_PARAGRAPH_BYTES)
+        generator.load_styles()
+        entry = xml_parser.get_entries_from_xml(elementTree.parse(LEXO_RANK_EXAMPLE))[0]
+        assignee_style = generator.get_assignee_style(entry.assignee)
+
+        first_table = generator.get_table_data(entry, assignee_style)
+        second_table = generator.get_table_data(entry, assignee_style)
+        self.assertIs(first_table[2][1], second_table[2][1])
+        self.assertEqual(generator.paragraphs.get_stats()["hits"], 6)
+
+
+class InputAdapterTests(unittest.TestCase):
+    """Test class for input_adapters.py."""
+
+    SEARCH_RESPONSE = {
+        "startAt": 0, "maxResults": 50, "total": 2,
+        "issues": [
+            {"key": "CG-12",
+             "fields": {"summary": "Print <cards>",
+                        "assignee": {"displayName": "Meyer, Max"},
+                        "description": "Cards & boards\nSecond line",
+                        "priority": {"name": "High"},
+                        "customfield_10019": "0|hzzzz7:"}},
+            {"key": "CG-13",
+             "fields": {"summary": "Read JSON", "assignee": None, "priority": None,
+                        "description": {"type": "doc", "content": [
+                            {"type": "paragraph", "content": [{"type": "text", "text": "One"}]},
+                            {"type": "paragraph", "content": [{"type": "text", "text": "Two"}]}]},
+                        "customfield_10019": "0|i00001:"}}],
+        "names": {"customfield_10019": "Rank"}}
+
+    def test_json_is_read_in_chunks(self):
+        """Test that the top level members are the same, no matter where the chunks end."""
+        text = json.dumps(self.SEARCH_RESPONSE, indent=1)
+
+        for chunk_size in (1, 7, 64, len(text)):
+            members = list(input_adapters.iter_json_object(io.StringIO(text), "issues",
+                                                           chunk_size))
+            self.assertEqual([name for name, _ in members],
+                             ["startAt", "maxResults", "total", "issues", "issues", "names"])
+            self.assertEqual([value for name, value in members if name == "issues"],
+                             self.SEARCH_RESPONSE["issues"])
+
+    def test_json_search_response(self):
+        """Test that issues of a REST search response become the same entries as xml items."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = os.path.join(work_directory, "search.json")
+            with open(export_path, "w", encoding="utf-8") as export_file:
+                json.dump(self.SEARCH_RESPONSE, export_file)
+            entries = list(xml_parser.iter_entries(export_path))
+
+        self.assertEqual(entries, [
+            card_record.Card("12", "Print &lt;cards&gt;", "Meyer, Max",
+                             "Cards &amp; boards\nSecond line", "High", "0|hzzzz7:"),
+            card_record.Card("13", "Read JSON", "Unassigned", "One\nTwo", "", "0|i00001:")])
+
+    def test_json_numeric_rank_from_names(self):
+        """Test that old numeric ranks are found through the field names, which Jira puts after
+        the issues."""
+        response = {"issues": [{"key": "CG-7", "fields": {"summary": "Old rank",
+                                                          "customfield_10100": "1234"}}],
+                    "names": {"customfield_10100": "Rank"}}
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = os.path.join(work_directory, "search.json")
+            with open(export_path, "w", encoding="utf-8") as export_file:
+                json.dump(response, export_file)
+            ranks = [entry.rank for entry in xml_parser.iter_entries(export_path)]
+
+        self.assertEqual(ranks, ["1234"])
+
+    def test_csv_export(self):
+        """Test that rows of a CSV export become entries, missing values get defaults."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = os.path.join(work_directory, "export.csv")
+            with open(export_path, "w", encoding="utf-8-sig", newline="") as export_file:
+                export_file.write('Summary,Issue key,Priority,Assignee,Description,Sprint,Sprint\r\n'
+                                  'Print cards,CG-1,High,"Meyer, Max","Line one\nLine two",S1,S2\r\n'
+                                  'Read CSV,CG-2,Low,,,S1,\r\n')
+            entries = list(xml_parser.iter_entries(export_path))
+            cards_per_assignee = xml_parser.summarize_export(export_path)
+
+        self.assertEqual(entries, [
+            card_record.Card("1", "Print cards", "Meyer, Max", "Line one\nLine two", "High", "0"),
+            card_record.Card("2", "Read CSV", "Unassigned", "", "Low", "0")])
+        self.assertEqual(cards_per_assignee, {"Meyer, Max": 1, "Unassigned": 1})
+        self.assertEqual(xml_parser.get_output_path(export_path), export_path[:-3] + "pdf")
+
+
+class MarkupValidatorTests(unittest.TestCase):
+    """Test class for markup_validator.py."""
+
+    def test_valid_markup_is_kept(self):
+        """Test that valid markup and plain text are not escaped."""
+        for test_string in ("Text <i>link</i> moreText", "Plain text", "<b>bold</b>"):
+            self.assertEqual(test_string, markup_validator.escape_if_invalid(test_string))
+
+    def test_invalid_markup_is_escaped(self):
+        """Test that unclosed and mismatched tags are escaped."""
+        self.assertEqual("&lt;b&gt;unclosed", markup_validator.escape_if_invalid("<b>unclosed"))
+        self.assertEqual("&lt;b&gt;bold&lt;/i&gt;",
+                         markup_validator.escape_if_invalid("<b>bold</i>"))
+
+    def test_validation_is_cached(self):
+        """Test that repeated values are only validated once."""
+        markup_validator.is_valid_markup.cache_clear()
+        markup_validator.is_valid_markup("<b>Highest</b>")
+        markup_validator.is_valid_markup("<b>Highest</b>")
+
+        cache_info = markup_validator.is_valid_markup.cache_info()
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 1)
+
+
+
+class PipelineTests(unittest.TestCase):
+    """Test class for pipeline.py."""
+
+    def test_pipelined_entries_match_sequential_entries(self):
+        """Test that both pipeline modes yield the same entries as reading the file directly."""
+        expected_entries = list(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+
+        for mode in pipeline.MODES:
+            # tiny batches and queue, so the parser has to wait for the consumer
+            entries = pipeline.iter_pipelined(xml_parser.iter_entries_from_file,
+                                              (LEXO_RANK_EXAMPLE,), mode, queue_size=1,
+                                              batch_size=3)
+            self.assertEqual(list(entries), expected_entries)
+
+    def test_parser_errors_are_raised(self):
+        """Test that errors of the parser are raised where the entries are read."""
+        for mode in pipeline.MODES:
+            entries = pipeline.iter_pipelined(xml_parser.iter_entries_from_file,
+                                              ("missing.xml",), mode)
+            with self.assertRaises(FileNotFoundError):
+                list(entries)
+
+    def test_pipeline_option_before_file(self):
+        """Test that --pipeline doesn't take the file as its value and that the mode is chosen
+        separately."""
+        arguments = xml_parser.parse_arguments(["--pipeline", LEXO_RANK_EXAMPLE])
+        self.assertEqual((arguments.pipeline, arguments.pipeline_mode, arguments.file),
+                         (True, "process", LEXO_RANK_EXAMPLE))
+
+        arguments = xml_parser.parse_arguments(["--pipeline", "--pipeline-mode", "thread",
+                                                LEXO_RANK_EXAMPLE])
+        self.assertEqual(arguments.pipeline_mode, "thread")
+
+    def test_stopping_early_stops_parser(self):
+        """Test that the parser stops once the consumer stops reading entries."""
+        first_entry = next(xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE))
+        entries = pipeline.iter_pipelined(xml_parser.iter_entries_from_file,
+                                          (LEXO_RANK_EXAMPLE,), queue_size=1, batch_size=1)
+        self.assertEqual(next(entries), first_entry)
+        entries.close()
+
+        self.assertFalse(any(thread.name != "MainThread" and thread.is_alive()
+                             for thread in threading.enumerate()))
+
+
+class PerformanceTests(unittest.TestCase):
+    """Checks how time and memory grow with the size of the input, so changes that make a
+    step quadratic or let memory grow without limit are noticed. Timings are compared with
+    each other rather than with fixed budgets, so the tests pass on slow machines too."""
+
+    # a linear step may take this many times longer than expected before the test fails,
+    # a quadratic one takes the growth factor times longer
+    TIME_TOLERANCE = 2.5
+    MEMORY_TOLERANCE = 1.3
+    # the peak also depends on when caches drop values, which varies by a few hundred KB
+    MEMORY_SLACK = 512 * 1024
+    MAX_ESCAPE_PROBES_PER_ITEM = 6
+
+    @staticmethod
+    def measure_seconds(function, repetitions: int = 5) -> float:
+        """Get the shortest time of several runs, which is the least disturbed one."""
+        durations = []
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        return min(durations)
+
+    @staticmethod
+    def measure_peak_memory(function) -> int:
+        """Get how far the allocated memory rose above its level before the function ran.
+        Memory has to be traced already, as values dropped from caches filled before tracing
+        started would not be subtracted."""
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        return tracemalloc.get_traced_memory()[1] - start_bytes
+
+    def assert_linear(self, small_seconds: float, large_seconds: float, growth: int):
+        """Check that the time grew about as much as the input did."""
+        self.assertLess(large_seconds, small_seconds * growth * self.TIME_TOLERANCE,
+                        f"{small_seconds:.4f}s grew to {large_seconds:.4f}s for {growth} times "
+                        "the input")
+
+    def test_link_removal_time_is_linear(self):
+        """Test that removing links takes time in proportion to the number of links."""
+        link = '<a href="https://example.com/backlog" class="external-link">backlog</a> text '
+        small_string = link * 2000
+        large_string = link * 16000
+
+        small_seconds = self.measure_seconds(lambda: xml_parser.remove_link_tags(small_string))
+        large_seconds = self.measure_seconds(lambda: xml_parser.remove_link_tags(large_string))
+        self.assert_linear(small_seconds, large_seconds, 8)
+
+    def test_description_sanitizing_stops_when_card_is_full(self):
+        """Test that sanitizing a description stops once the card is full, so a much longer
+        description gives the same result after the same work."""
+        paragraph = "<p>A description with <b>markup</b> <a href=\"x\">a</a> &amp; text</p> "
+        small_string = paragraph * 20
+        large_string = paragraph * 20000
+
+        counters = []
+        for string in (small_string, large_string):
+            profile = profiling.enable()
+            try:
+                sanitized_description = xml_parser.sanitize_description(string)
+            finally:
+                profiling.disable()
+            counters.append((sanitized_description, dict(profile.counters)))
+
+        self.assertEqual(counters[0], counters[1])
+        self.assertEqual(counters[0][1]["descriptionsTrimmed"], 1)
+        self.assertLess(counters[0][1]["linksStripped"], 20)
+
+    def test_escape_probes_per_item(self):
+        """Test that each value of an item is checked for invalid markup at most once."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = os.path.join(work_directory, "export.xml")
+            benchmark.write_export(export_path, 200, links=2)
+
+            markup_validator.is_valid_markup.cache_clear()
+            entries = list(xml_parser.iter_entries(export_path))
+
+        cache_info = markup_validator.is_valid_markup.cache_info()
+        self.assertLessEqual(cache_info.hits + cache_info.misses,
+                             self.MAX_ESCAPE_PROBES_PER_ITEM * len(entries))
+
+    @unittest.skipUnless(SLOW_TESTS, "set CARDGEN_SLOW_TESTS=1 to run slow performance tests")
+    def test_generation_time_is_linear(self):
+        """Test that parsing and rendering take time in proportion to the number of items."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            durations = []
+            for item_count in (250, 1000):
+                export_path = os.path.join(work_directory, f"export{item_count}.xml")
+                benchmark.write_export(export_path, item_count)
+
+                def generate():
+                    card_generator.Generator().create_pdf(xml_parser.iter_entries(export_path),
+                                                          export_path[:-3] + "pdf")
+                durations.append(self.measure_seconds(generate, repetitions=2))
+
+        self.assert_linear(durations[0], durations[1], 4)
+
+    @unittest.skipUnless(SLOW_TESTS, "set CARDGEN_SLOW_TESTS=1 to run slow performance tests")
+    def test_streaming_memory_is_flat(self):
+        """Test that memory doesn't grow with the number of items when the export is read
+        incrementally and written in parts. The large export is processed once before
+        measuring, so bounded caches like the one of markup_validator.py are full in both runs."""
+        try:
+            with tempfile.TemporaryDirectory() as work_directory:
+                export_paths = []
+                for item_count in (400, 1600):
+                    export_paths.append(os.path.join(work_directory, f"export{item_count}.xml"))
+                    benchmark.write_export(export_paths[-1], item_count)
+
+                def parse(export_path):
+                    for _ in xml_parser.iter_entries(export_path):
+                        pass
+
+                def render(export_path):
+                    generator = card_generator.Generator()
+                    generator.create_pdf_parts(xml_parser.iter_entries(export_path),
+                                               export_path[:-3] + "pdf", 10)
+
+                tracemalloc.start()
+                render(export_paths[-1])
+                parse_peaks = [self.measure_peak_memory(lambda: parse(export_path))
+                               for export_path in export_paths]
+                render_peaks = [self.measure_peak_memory(lambda: render(export_path))
+                                for export_path in export_paths]
+        finally:
+            tracemalloc.stop()
+
+        for small_peak, large_peak in (parse_peaks, render_peaks):
+            self.assertLess(large_peak, small_peak * self.MEMORY_TOLERANCE + self.MEMORY_SLACK,
+                            f"the peak grew from {small_peak} to {large_peak} bytes")
+
+
+class ProfilingTests(unittest.TestCase):
+    """Test class for profiling.py."""
+
+    def tearDown(self):
+        profiling.disable()
+
+    def test_disabled_profiling(self):
+        """Test that hooks do nothing while profiling is disabled."""
+        xml_parser.remove_link_tags("Text<a href=bla></a>moreText")
+        with profiling.stage("render"):
+            pass
+
+        self.assertFalse(profiling.is_enabled())
+        self.assertIsNone(profiling.snapshot())
+
+    def test_stages_and_events(self):
+        """Test that stages and events of a generation run are recorded."""
+        profile = profiling.enable()
+        with tempfile.TemporaryDirectory() as output_directory:
+            entries = xml_parser.iter_entries_from_file(LEXO_RANK_EXAMPLE)
+            card_generator.Generator().create_pdf(entries,
+                                                  os.path.join(output_directory, "cards.pdf"))
+
+        snapshot = profile.snapshot()
+        self.assertEqual(set(snapshot["stages"]), {"parse", "entries", "render", "save"})
+        self.assertEqual(snapshot["counters"]["itemsParsed"], 8)
+        self.assertEqual(snapshot["counters"]["pagesEmitted"], 2)
+        self.assertEqual(snapshot["counters"]["linksStripped"], 1)
+
+    def test_events_are_counted_with_fragment_cache(self):
+        """Test that values taken from a saved fragment cache still count their events."""
+        with tempfile.TemporaryDirectory() as work_directory:
+            export_path = shutil.copy(LEXO_RANK_EXAMPLE, work_directory)
+            cache_path = os.path.join(work_directory, "fragments.cache")
+            arguments = xml_parser.parse_arguments(["--profile", "--fragment-cache", cache_path,
+                                                    export_path])
+            counters = []
+            for _ in range(2):
+                xml_parser.generate_cards(export_path, xml_parser.get_output_path(export_path),
+                                          arguments)
+                with open(export_path[:-4] + "_profile.json", encoding="utf-8") as report_file:
+                    counters.append(json.load(report_file)["counters"])
+
+        self.assertFalse(xml_parser.SANITIZED_STRINGS.is_enabled())
+        self.assertEqual(counters[0]["linksStripped"], 1)
+        self.assertEqual(counters[1]["linksStripped"], 1)
+        self.assertGreater(counters[1]["sanitizedHits"], 0)
+
+
+class TextFittingTests(unittest.TestCase):
+    """Test class for text_fitting.py."""
+
+    def test_line_breaks_match_paragraph(self):
+        """Test that texts are broken into the same lines as reportlab breaks them."""
+        generator = card_generator.Generator()
+        generator.load_styles()
+        style = generator.styles["description"]
+        width = generator.COLUMN_WIDTHS[1] - 12
+        test_strings = ["A short description",
+                        "<p>Some <b>bold words</b> and <i>a link</i> &amp; more</p>" * 4,
+                        "first line<br/>second line<br/><br/>fourth line",
+                        "a" * 90 + " word " + "verylongword" * 12 + " end"]
+
+        for test_string in test_strings:
+            measured_text = text_fitting.MeasuredText(test_string, style.fontName)
+            for font_size in generator.DESCRIPTION_SIZES:
+                paragraph = card_generator.Paragraph(test_string,
+                                                     generator.get_sized_style(style, font_size))
+                paragraph.wrap(width, 1000)
+                self.assertEqual(len(measured_text.break_lines(width / font_size)),
+                                 len(paragraph.blPara.lines))
+
+    def test_fitted_text_stays_in_cell(self):
+        """Test that a fitted text is never higher than its cell."""
+        generator = card_generator.Generator()
+        generator.load_styles()
+        style = generator.styles["summary"]
+        test_string = "A summary that gets longer and longer"
+
+        for repeats in (1, 2, 4, 8):
+            paragraph = generator.fit_paragraph(test_string * repeats, style,
+                                                generator.SUMMARY_SIZES, 1, 1)
+            _, height = paragraph.wrap(generator.COLUMN_WIDTHS[1] - 12, 1000)
+            self.assertLessEqual(height, generator.ROW_HEIGHTS[1] - 6)
+
+    def test_truncated_text_keeps_markup_valid(self):
+        """Test that texts that don't fit end with an ellipsis and close their open tags."""
+        test_string = "<p>Some words <b>" + "and more bold words " * 40 + "</b></p>"
+
+        font_size, fitted_text = text_fitting.fit_text(test_string, "Helvetica", (11, 10, 9),
+                                                       300, 50, 12 / 11)
+        self.assertEqual(font_size, 9)
+        self.assertTrue(fitted_text.endswith("...</b></p>"))
+        self.assertTrue(markup_validator.is_valid_markup(fitted_text))
+
+        font_size, fitted_text = text_fitting.fit_text("x" * 200, "Helvetica", (11,), 50, 12,
+                                                       12 / 11, max_lines=1)
+        self.assertTrue(fitted_text.endswith("..."))
+        self.assertLessEqual(text_fitting.get_width(fitted_text, "Helvetica") * font_size, 50)
+
+
 if __name__ == '__main__':
     unittest.main()
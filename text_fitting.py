@@ -0,0 +1,230 @@
+"""Fits card texts into their cells by measuring them with the width metrics of the standard
+Helvetica fonts. A text is measured once, at font size 1, as widths grow proportionally with
+the font size. Lines are then broken like reportlab breaks the lines of a Paragraph, so the
+largest fitting font size and the truncation point are found without laying out any trial
+paragraphs. Widths of words are cached, as the same words appear on many cards."""
+import functools
+import html
+import math
+import re
+from typing import Iterator
+
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+import profiling
+
+ELLIPSIS = "..."
+# tags, entities, whitespace and text, a single "<" or "&" is text as well
+TOKEN_PATTERN = re.compile(r"</?[A-Za-z][^<>]*>|&#?\w+;|\s+|[^<&\s]+|[<&]")
+TAG_NAME_PATTERN = re.compile(r"</?([A-Za-z][\w:-]*)")
+BOLD_TAGS = ("b", "strong")
+ITALIC_TAGS = ("i", "em")
+LINE_BREAK_TAGS = ("br",)
+VOID_TAGS = ("br", "img")
+FONTS = {(False, False): "Helvetica",
+         (True, False): "Helvetica-Bold",
+         (False, True): "Helvetica-Oblique",
+         (True, True): "Helvetica-BoldOblique"}
+# all Helvetica variants share the widths of spaces and dots
+SPACE_WIDTH = stringWidth(" ", "Helvetica", 1)
+ELLIPSIS_WIDTH = stringWidth(ELLIPSIS, "Helvetica", 1)
+SPACE_SHRINKAGE = getattr(ParagraphStyle("default"), "spaceShrinkage", 0)
+
+
+@functools.lru_cache(maxsize=65536)
+def get_width(text: str, font_name: str) -> float:
+    """Get the width of a text at font size 1."""
+    return stringWidth(text, font_name, 1)
+
+
+class MeasuredText:
+    """A paragraph text split into tokens and words, with the width of each word at font
+    size 1. Words are runs of text between whitespace, markup inside a word belongs to it."""
+
+    def __init__(self, text: str, font_name: str):
+        self.tokens = TOKEN_PATTERN.findall(text)
+        # the font of each text or entity token, None for tags and whitespace
+        self.fonts = [None] * len(self.tokens)
+        # [width, index of the first token, index after the last token], None for line breaks
+        self.words = []
+
+        base_bold = "Bold" in font_name
+        base_italic = "Oblique" in font_name
+        bold_depth = 0
+        italic_depth = 0
+        word = None
+
+        for index, token in enumerate(self.tokens):
+            tag_match = TAG_NAME_PATTERN.match(token) if token[0] == "<" else None
+            if tag_match:
+                name = tag_match.group(1).lower()
+                change = -1 if token.startswith("</") else 1
+                if name in LINE_BREAK_TAGS:
+                    self.words.append(None)
+                    word = None
+                    continue
+                if name in BOLD_TAGS:
+                    bold_depth = max(0, bold_depth + change)
+                elif name in ITALIC_TAGS:
+                    italic_depth = max(0, italic_depth + change)
+                if word is not None:
+                    word[2] = index + 1
+                continue
+
+            if token.isspace():
+                word = None
+                continue
+
+            font = FONTS[(base_bold or bold_depth > 0, base_italic or italic_depth > 0)]
+            self.fonts[index] = font
+            width = get_width(html.unescape(token) if token[0] == "&" else token, font)
+            if word is None:
+                word = [0.0, index, index + 1]
+                self.words.append(word)
+            word[0] += width
+            word[2] = index + 1
+
+    def break_lines(self, line_width: float) -> list[list[list]]:
+        """Break the words into lines of the given width at font size 1. A word that is split
+        over several lines is part of the line its last piece is on."""
+        lines = []
+        line = None
+        used_width = 0.0
+
+        for word in self.words:
+            if word is None:
+                lines.append(line or [])
+                line = None
+                continue
+
+            # reportlab lets each space of a line shrink a little before breaking it
+            if line is not None and used_width + SPACE_WIDTH + word[0] <= \
+                    line_width + SPACE_SHRINKAGE * SPACE_WIDTH * len(line):
+                line.append(word)
+                used_width += SPACE_WIDTH + word[0]
+                continue
+
+            if word[0] > line_width:
+                # reportlab splits words longer than a line, the first piece fills up the
+                # current line and the last piece starts the next line other words can follow
+                available_width = line_width - used_width - SPACE_WIDTH if line else line_width
+                piece_widths = self.split_word(word, available_width, line_width)
+                for _ in piece_widths[:-1]:
+                    lines.append(line or [])
+                    line = None
+                used_width = piece_widths[-1]
+            else:
+                if line is not None:
+                    lines.append(line)
+                used_width = word[0]
+            line = [word]
+
+        if line is not None:
+            lines.append(line)
+        return lines
+
+    def split_word(self, word: list, available_width: float, line_width: float) -> list[float]:
+        """Get the widths of the pieces reportlab splits a long word into, the first piece has
+        to fit into the available width and all others into a whole line."""
+        piece_widths = []
+        piece_width = 0.0
+        for character, font_name in self.iter_characters(word):
+            character_width = get_width(character, font_name)
+            if piece_width + character_width > available_width and \
+                    (piece_width or character_width <= line_width):
+                piece_widths.append(piece_width)
+                available_width = line_width
+                piece_width = 0.0
+            piece_width += character_width
+        piece_widths.append(piece_width)
+        return piece_widths
+
+    def iter_characters(self, word: list) -> Iterator[tuple[str, str]]:
+        """Yield each character of a word shown on the card, together with its font."""
+        for index in range(word[1], word[2]):
+            font_name = self.fonts[index]
+            if font_name is not None:
+                token = self.tokens[index]
+                for character in html.unescape(token) if token[0] == "&" else token:
+                    yield character, font_name
+
+    def truncate(self, lines: list[list[list]], line_width: float) -> str:
+        """Get the markup of the given lines with an ellipsis at the end of the last one."""
+        last_line = list(lines[-1])
+        used_width = sum(word[0] for word in last_line) + SPACE_WIDTH * (len(last_line) - 1)
+        while len(last_line) > 1 and used_width + ELLIPSIS_WIDTH > line_width:
+            used_width -= last_line.pop()[0] + SPACE_WIDTH
+
+        kept_lines = [line for line in lines[:-1] if line] + ([last_line] if last_line else [])
+        if not kept_lines:
+            return ELLIPSIS
+        last_word = kept_lines[-1][-1]
+
+        if used_width + ELLIPSIS_WIDTH <= line_width:
+            parts = self.tokens[:last_word[2]]
+        else:
+            # the only word of the line is too long, so it is cut between characters
+            parts = self.tokens[:last_word[1]] + \
+                self.cut_word(last_word, line_width - ELLIPSIS_WIDTH - (used_width - last_word[0]))
+
+        closing_tags = [f"</{tag}>" for tag in reversed(get_open_tags(parts))]
+        return "".join(parts) + ELLIPSIS + "".join(closing_tags)
+
+    def cut_word(self, word: list, available_width: float) -> list[str]:
+        """Get the tokens of a word up to the given width, text tokens are cut between
+        characters, tags and entities are kept whole or left out."""
+        parts = []
+        for index in range(word[1], word[2]):
+            token = self.tokens[index]
+            font_name = self.fonts[index]
+            if font_name is None:
+                parts.append(token)
+                continue
+            if token[0] == "&" and len(token) > 1:
+                width = get_width(html.unescape(token), font_name)
+                if width > available_width:
+                    break
+                parts.append(token)
+                available_width -= width
+                continue
+            for length in range(len(token), -1, -1):
+                if get_width(token[:length], font_name) <= available_width:
+                    break
+            parts.append(token[:length])
+            if length < len(token):
+                break
+            available_width -= get_width(token, font_name)
+        return parts
+
+
+def get_open_tags(parts: list[str]) -> list[str]:
+    """Get the tags that are still open at the end of the parts, in the order they are opened."""
+    open_tags = []
+    for part in parts:
+        match = TAG_NAME_PATTERN.match(part)
+        if not match or part.endswith("/>") or match.group(1).lower() in VOID_TAGS:
+            continue
+        if not part.startswith("</"):
+            open_tags.append(match.group(1))
+        elif open_tags and open_tags[-1] == match.group(1):
+            open_tags.pop()
+    return open_tags
+
+
+def fit_text(text: str, font_name: str, font_sizes: tuple[float, ...], width: float,
+             height: float, leading_ratio: float, max_lines: int = None) -> (float, str):
+    """Find the largest of the font sizes (from largest to smallest) at which the text fits into
+    a cell of the given size. If it doesn't fit at any of them, the text is truncated at the
+    smallest size and ends with an ellipsis. Returns the font size and the text to draw."""
+    measured_text = MeasuredText(text, font_name)
+    for font_size in font_sizes:
+        line_count = math.floor(height / (font_size * leading_ratio) + 1e-9)
+        if max_lines is not None:
+            line_count = min(line_count, max_lines)
+        lines = measured_text.break_lines(width / font_size)
+        if len(lines) <= line_count:
+            return font_size, text
+
+    profiling.count("textsTruncated")
+    return font_size, measured_text.truncate(lines[:max(1, line_count)], width / font_size)
@@ -1,54 +1,322 @@
 """Reads a given XML and passed its values to card_generator.py to create a pdf of cards.
 Once the generation is complete, the created pdf file will be opened automatically with the
-standard programme for this file type"""
-import html
+standard programme for this file type. Use --batch or --watch to create pdfs for a whole
+directory of exports without opening them. JSON and CSV exports are read by input_adapters.py,
+chosen by the file extension."""
+import argparse
+import collections
+import concurrent.futures
+import glob
 import os
+import re
 import subprocess
 import sys
+import time
 import xml.etree.ElementTree as elementTree
-
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import Paragraph
-
-import card_generator
-
-
-def get_entries_from_xml(xml_tree: elementTree):
-    """Convert xml data to a list of dictionaries, with one entry for each backlog item."""
+from typing import Iterator
+
+import card_cache
+import card_filter
+import card_layout
+import card_record
+import export_index
+import fragment_cache
+import input_adapters
+import markup_validator
+import pipeline
+import profiling
+
+# only a coarse limit, card_generator.py fits descriptions into their cell by measuring them
+MAX_DESCRIPTION_LENGTH = 500
+MAX_NEW_LINES = 4
+LINK_START = "<a href"
+LINK_END = "</a>"
+LINK_REPLACEMENT = " <i>link</i> "
+# tags without a closing tag, they are never left open when a description is cut
+VOID_TAGS = ("br", "img")
+TEXT_PATTERN = re.compile(r"[^<&\n]+")
+TAG_PATTERN = re.compile(r"</?([A-Za-z][\w:-]*)[^<>]*>")
+ENTITY_PATTERN = re.compile(r"&#?\w+;")
+PROFILE_SUFFIX = "_profile.json"
+# json files written next to the exports, a glob like "exports/*.json" must not pick them up
+OWN_FILE_SUFFIXES = (PROFILE_SUFFIX, export_index.INDEX_SUFFIX)
+MAX_SANITIZED_BYTES = 16 * 1024 * 1024
+# sanitized values and descriptions by their raw text, only kept with --fragment-cache
+SANITIZED_STRINGS = fragment_cache.FragmentCache("sanitized", 0)
+
+
+def get_entries_from_xml(xml_tree: elementTree) -> list[card_record.Card]:
+    """Convert xml data to a list of card records, with one entry for each backlog item."""
     entries = []
 
     for item in xml_tree.iter("item"):
-        entry = {}
-
-        entry["summary"] = extract_value(item, "summary")
-        entry["assignee"] = extract_value(item, "assignee")
-        entry["description"] = extract_description(item)
-
-        key = extract_value(item, "key")
-        key_parts = key.split("-")
-        entry["key"] = key_parts[1]
+        with profiling.stage("entries"):
+            entries.append(get_entry_from_item(item))
 
-        entry["priority"] = extract_value(item, "priority")
-        entry["rank"] = extract_rank_from_custom_fields(item)
+    return entries
 
-        entries.append(entry)
 
-    return entries
+def iter_entries(file_path: str, selection: card_filter.CardFilter = None,
+                 use_index: bool = False) -> Iterator[card_record.Card]:
+    """Read the export incrementally and yield one entry for each selected backlog item, the
+    format is chosen by the file extension. With use_index, xml exports are read through
+    their sidecar index, which is created on the first run."""
+    read_values = input_adapters.get_reader(file_path)
+    if read_values is None:
+        if use_index and export_index.can_be_indexed(file_path):
+            yield from iter_entries_with_index(file_path, selection)
+        else:
+            yield from iter_entries_from_file(file_path, selection)
+        return
+
+    for values in read_values(file_path):
+        if selection is not None and not selection.matches_values(values):
+            profiling.count("itemsSkipped")
+            continue
+        with profiling.stage("entries"):
+            entry = get_entry_from_values(*values)
+        yield entry
+
+
+def iter_entries_from_file(file_path: str,
+                           selection: card_filter.CardFilter = None) -> Iterator[card_record.Card]:
+    """Read the xml file incrementally and yield one entry for each selected backlog item."""
+    for item in iter_items_from_file(file_path):
+        if selection is not None and not selection.matches(*get_filter_values(item)):
+            profiling.count("itemsSkipped")
+            continue
+        with profiling.stage("entries"):
+            entry = get_entry_from_item(item)
+        yield entry
+
+
+def iter_entries_with_index(file_path: str,
+                            selection: card_filter.CardFilter = None) -> Iterator[card_record.Card]:
+    """Yield the entries of the selected items, reading only their bytes if the export has a
+    valid index. Otherwise every item is read and the index is written afterwards."""
+    records = export_index.load_index(file_path)
+    if records is not None:
+        selected_records = [record for record in records
+                            if selection is None or selection.matches(*record[2:])]
+        profiling.count("itemsSkipped", len(records) - len(selected_records))
+        for item_bytes in export_index.read_items(file_path, selected_records):
+            with profiling.stage("parse"):
+                item = elementTree.fromstring(item_bytes)
+            with profiling.stage("entries"):
+                entry = get_entry_from_item(item)
+            yield entry
+        return
+
+    records = []
+    source_state = export_index.get_source_state(file_path)
+    for offset, item_bytes in export_index.iter_item_bytes(file_path):
+        with profiling.stage("parse"):
+            item = elementTree.fromstring(item_bytes)
+        filter_values = get_filter_values(item)
+        records.append([offset, len(item_bytes), *filter_values])
+        if selection is not None and not selection.matches(*filter_values):
+            profiling.count("itemsSkipped")
+            continue
+        with profiling.stage("entries"):
+            entry = get_entry_from_item(item)
+        yield entry
+    export_index.save_index(file_path, records, source_state)
+
+
+def get_filter_values(item: elementTree.Element) -> (str, str, str, str):
+    """Get the raw key, assignee, priority and rank of an item, without sanitizing them."""
+    return (item.findtext("key") or "", item.findtext("assignee") or "",
+            item.findtext("priority") or "", find_rank(item) or "")
+
+
+def iter_items_from_file(file_path: str) -> Iterator[elementTree.Element]:
+    """Read the xml file incrementally and yield each item element once it is complete.
+
+    Every item element is cleared and detached from its parent once the caller is done with
+    it, so memory use stays constant no matter how large the export is."""
+    parents = []
+
+    xml_events = elementTree.iterparse(file_path, events=("start", "end"))
+    for event, element in profiling.timed(xml_events, "parse"):
+        if event == "start":
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag == "item":
+            yield element
+
+            element.clear()
+            if parents:
+                parents[-1].remove(element)
+
+
+def summarize_export(file_path: str,
+                     selection: card_filter.CardFilter = None) -> collections.Counter:
+    """Count the cards of each assignee, without sanitizing any values or rendering."""
+    cards_per_assignee = collections.Counter()
+    read_values = input_adapters.get_reader(file_path)
+    if read_values is not None:
+        for values in read_values(file_path):
+            if selection is None or selection.matches_values(values):
+                cards_per_assignee[values[card_record.FIELDS.index("assignee")]] += 1
+        return cards_per_assignee
+
+    for item in iter_items_from_file(file_path):
+        if selection is None or selection.matches(*get_filter_values(item)):
+            cards_per_assignee[item.findtext("assignee") or ""] += 1
+    return cards_per_assignee
+
+
+def get_entry_from_item(item: elementTree.Element) -> card_record.Card:
+    """Convert a single xml item to a card record containing the values shown on its card."""
+    summary = extract_value(item, "summary")
+    assignee = extract_value(item, "assignee")
+    description = extract_description(item)
+
+    key = extract_value(item, "key")
+    key_parts = key.split("-")
+
+    priority = extract_value(item, "priority")
+    rank = extract_rank_from_custom_fields(item)
+
+    profiling.count("itemsParsed")
+    return card_record.Card(key_parts[1], summary, assignee, description, priority, rank)
+
+
+def get_entry_from_values(key: str, summary: str, assignee: str, description: str,
+                          priority: str, rank: str) -> card_record.Card:
+    """Sanitize the raw values of an item read by input_adapters.py, like the values of xml
+    items, and create its card record."""
+    if description:
+        description = sanitize_and_escape_description(description)
+    key_parts = sanitize_value(key).split("-")
+
+    profiling.count("itemsParsed")
+    return card_record.Card(key_parts[-1], sanitize_value(summary), sanitize_value(assignee),
+                            description, sanitize_value(priority), sanitize_value(rank))
 
 
 def extract_description(item: elementTree.Element):
     """Extract description of item"""
-    description = extract_value(item, "description")
-    description = remove_excessive_new_lines(description)
-    description = trim_description(description)
-
-    return description
+    description = item.find("description").text
+    if description is None:
+        return ""
+
+    return sanitize_and_escape_description(description)
+
+
+def sanitize_and_escape_description(description: str) -> str:
+    """Sanitize a description and escape it if it still isn't valid markup, descriptions that
+    were sanitized before are taken from the cache."""
+    sanitized_description = SANITIZED_STRINGS.get(("description", description))
+    if sanitized_description is None:
+        with SANITIZED_STRINGS.recorded_events() as events:
+            sanitized_description = check_and_escape(sanitize_description(description))
+        SANITIZED_STRINGS.put(("description", description), sanitized_description,
+                              fragment_cache.get_text_size(description, sanitized_description),
+                              events)
+    return sanitized_description
+
+
+def sanitize_description(description: str) -> str:
+    """Remove links, limit new lines and trim the description in one pass over the text.
+
+    Gives the same result as remove_link_tags, remove_excessive_new_lines and trim_description
+    combined, but stops reading as soon as the card is full. Tags and entities are never cut
+    in half and tags still open at the cut are closed, so the result stays valid markup."""
+    parts = []
+    length = 0
+    new_lines = 0
+    open_tags = []
+    index = 0
+
+    while index < len(description):
+        character = description[index]
+        tag_match = TAG_PATTERN.match(description, index) if character == "<" else None
+        entity_match = ENTITY_PATTERN.match(description, index) if character == "&" else None
+        is_tag = False
+        is_atomic = True
+
+        if description.startswith(LINK_START, index):
+            end_index = description.find(LINK_END, index)
+            index = len(description) if end_index == -1 else end_index + len(LINK_END)
+            token = LINK_REPLACEMENT
+            profiling.count("linksStripped")
+        elif tag_match:
+            token = tag_match.group()
+            is_tag = True
+            index += len(token)
+
+            new_lines += token.count("\n")
+            if new_lines >= MAX_NEW_LINES:
+                # the fourth new line is inside this tag, so the tag is left out
+                close_open_tags(parts, open_tags)
+                break
+        elif entity_match:
+            token = entity_match.group()
+            index += len(token)
+        elif character == "\n":
+            new_lines += 1
+            if new_lines >= MAX_NEW_LINES:
+                # snip description before the fourth new line
+                close_open_tags(parts, open_tags)
+                break
+            token = character
+            index += 1
+        else:
+            # plain text up to the next tag, entity or new line - a single "<" or "&" is text too
+            text_match = TEXT_PATTERN.match(description, index)
+            token = text_match.group() if text_match else character
+            is_atomic = False
+            index += len(token)
+
+        if length + len(token) > MAX_DESCRIPTION_LENGTH:
+            # keep up to one character more than the maximum, like trim_description does
+            allowed_length = MAX_DESCRIPTION_LENGTH + 1 - length
+            if is_atomic:
+                # tags, entities and links are never cut, they are dropped if they don't fit
+                token = token if len(token) <= allowed_length else ""
+            else:
+                token = token[:allowed_length]
+            if is_tag and token:
+                update_open_tags(open_tags, token)
+            parts.append(token + "...")
+            close_open_tags(parts, open_tags)
+            profiling.count("descriptionsTrimmed")
+            break
+
+        if is_tag:
+            update_open_tags(open_tags, token)
+        parts.append(token)
+        length += len(token)
+
+    return "".join(parts)
+
+
+def close_open_tags(parts: list[str], open_tags: list[str]):
+    """Close the tags that are still open where the description is cut."""
+    parts.extend(f"</{tag}>" for tag in reversed(open_tags))
+
+
+def update_open_tags(open_tags: list[str], tag: str):
+    """Keep track of tags that are opened and closed again while a description is read."""
+    match = TAG_PATTERN.match(tag)
+    if tag.endswith("/>") or match.group(1).lower() in VOID_TAGS:
+        return
+
+    name = match.group(1)
+    if not tag.startswith("</"):
+        open_tags.append(name)
+    elif open_tags and open_tags[-1] == name:
+        open_tags.pop()
 
 
 def trim_description(description: str) -> str:
-    """Trim description, if it is longer than 160 characters."""
-    if len(description) > 160:
-        description = description[0:161] + '...'
+    """Trim description, if it is longer than MAX_DESCRIPTION_LENGTH characters."""
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        description = description[0:MAX_DESCRIPTION_LENGTH + 1] + '...'
+        profiling.count("descriptionsTrimmed")
     return description
 
 
@@ -64,9 +332,14 @@ def extract_value(item: elementTree.Element, key: str) -> str:
 
 def sanitize_value(value: str) -> str:
     """Remove values that would break card generation."""
-    value = remove_link_tags(value)
-    value = check_and_escape(value)
-    return value
+    sanitized_value = SANITIZED_STRINGS.get(("value", value))
+    if sanitized_value is None:
+        with SANITIZED_STRINGS.recorded_events() as events:
+            sanitized_value = remove_link_tags(value)
+            sanitized_value = check_and_escape(sanitized_value)
+        SANITIZED_STRINGS.put(("value", value), sanitized_value,
+                              fragment_cache.get_text_size(value, sanitized_value), events)
+    return sanitized_value
 
 
 def initialize_tkinter():
@@ -78,13 +351,9 @@ def initialize_tkinter():
 
 def check_and_escape(string: str) -> str:
     """Check if string can be used by Reportlab and escape if needed."""
-    # reportLab can't handle gifs (they cause a hard crash), so we try to create a Paragraph
-    # and escape if this doesn't work
-    try:
-        Paragraph(string, getSampleStyleSheet()['BodyText'])
-        return string
-    except ValueError:
-        return html.escape(string)
+    # reportLab can't handle gifs (they cause a hard crash), so we validate the markup
+    # and escape if it can't be parsed
+    return markup_validator.escape_if_invalid(string)
 
 
 def remove_excessive_new_lines(string: str) -> str:
@@ -105,23 +374,37 @@ def remove_excessive_new_lines(string: str) -> str:
 
 def remove_link_tags(string: str) -> str:
     """Remove link tags in string."""
-    tag_start_index = string.find("<a href")
+    parts = []
+    index = 0
+    tag_start_index = string.find(LINK_START)
     while tag_start_index != -1:
-        end_index = string.find("</a>", tag_start_index)
-        string = string[0:tag_start_index] + " <i>link</i> " + string[end_index + 4:]
-        tag_start_index = string.find("<a href")
-    return string
+        end_index = string.find(LINK_END, tag_start_index)
+        parts.append(string[index:tag_start_index])
+        parts.append(LINK_REPLACEMENT)
+        profiling.count("linksStripped")
+
+        # a link that is never closed takes up the rest of the string
+        index = len(string) if end_index == -1 else end_index + len(LINK_END)
+        tag_start_index = string.find(LINK_START, index)
+
+    parts.append(string[index:])
+    return "".join(parts)
 
 
 def extract_rank_from_custom_fields(item: elementTree.Element) -> str:
     """Get the rank value from the custom fields."""
+    rank = find_rank(item)
+    rank = sanitize_value(rank)
+    return rank
+
+
+def find_rank(item: elementTree.Element) -> str:
+    """Get the raw rank value from the custom fields, "0" if the item has no rank."""
     rank = "0"
     for custom_field in item.iter("customfield"):
         if custom_field.find("customfieldname").text == "Rank":
             for values in custom_field.iter("customfieldvalue"):
                 rank = values.text
-
-    rank = sanitize_value(rank)
     return rank
 
 
@@ -135,28 +418,305 @@ def open_output_file(file_path: str):
         subprocess.call(["xdg-open", file_path])
 
 
-def get_file_paths() -> (str, str):
+def parse_arguments(arguments: list[str] = None) -> argparse.Namespace:
+    """Read the command line options."""
+    parser = argparse.ArgumentParser(description="Create a pdf of cards from a Jira xml export.")
+    parser.add_argument("file", nargs="?",
+                        help="xml, json or csv export to read, a file dialog is shown if no "
+                             "file is given. With --batch or --watch, a directory of xml files "
+                             "or a glob pattern")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to render the pdf, or the files of a "
+                             "batch (default: 1)")
+    parser.add_argument("--batch", action="store_true",
+                        help="create pdfs for all xml files in a directory or matching a glob "
+                             "pattern, without opening them")
+    parser.add_argument("--watch", action="store_true",
+                        help="like --batch, but keep running and create the pdf again whenever "
+                             "an xml file changes")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="seconds between checks for changed files in watch mode (default: 2)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only count the cards of each assignee, without creating a pdf")
+    parser.add_argument("--no-open", action="store_true",
+                        help="don't open the created pdf")
+    parser.add_argument("--profile", action="store_true",
+                        help="write the time spent in each stage and counts of key events "
+                             "as JSON next to the pdf")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="reuse pages rendered by earlier runs that are stored in this "
+                             "directory and only render pages with changed cards")
+    parser.add_argument("--cache-size", type=int, default=100, metavar="MB",
+                        help="maximum size of the page cache in megabytes (default: 100)")
+    parser.add_argument("--delta", action="store_true",
+                        help="with --cache, also create a pdf containing only the cards that "
+                             "changed since the last run")
+    parser.add_argument("--cards-per-page", type=int, default=card_layout.DEFAULT_CARDS_PER_PAGE,
+                        choices=sorted(card_layout.GRIDS),
+                        help="number of cards on each page, cards are scaled to fit "
+                             f"(default: {card_layout.DEFAULT_CARDS_PER_PAGE})")
+    parser.add_argument("--paper", default=card_layout.DEFAULT_PAPER,
+                        choices=sorted(card_layout.PAPER_SIZES),
+                        help=f"paper size (default: {card_layout.DEFAULT_PAPER})")
+    parser.add_argument("--duplex", action="store_true",
+                        help="follow every page with a page of back sides showing the keys, "
+                             "for printing on both sides")
+    parser.add_argument("--no-compress", action="store_true",
+                        help="write the page contents uncompressed, which makes the pdf about "
+                             "three times larger but its source readable for debugging")
+    parser.add_argument("--pages-per-part", type=int, metavar="PAGES",
+                        help="split the pdf into numbered part files with up to this many pages "
+                             "of cards each, every part is written as soon as it is full. "
+                             "Parts are rendered by one process")
+    parser.add_argument("--fragment-cache", metavar="FILE",
+                        help="load sanitized values and laid out card texts from this file and "
+                             "save them again afterwards, so the next run can reuse them. Only "
+                             "use files written by this option")
+    parser.add_argument("--keys", metavar="KEYS",
+                        help="only create cards for these keys and key ranges, compared by "
+                             "their number, like \"12,15-20,CG-31\"")
+    parser.add_argument("--assignee", action="append", metavar="NAME",
+                        help="only create cards assigned to this person, can be given several "
+                             "times")
+    parser.add_argument("--priority", action="append", metavar="PRIORITY",
+                        help="only create cards with this priority, can be given several times")
+    parser.add_argument("--ranks", metavar="FROM..TO",
+                        help="only create cards with a rank in this range, like 100..250 or "
+                             "\"0|hzzzz7:..0|i0000f:\", either end may be left out")
+    parser.add_argument("--index", action="store_true",
+                        help="keep an index of the items next to an xml export, so later "
+                             "selections only read the selected items")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="parse the export in another process or thread while the cards are "
+                             "rendered")
+    parser.add_argument("--pipeline-mode", default="process", choices=pipeline.MODES,
+                        help="with --pipeline, where the export is parsed (default: process)")
+    parser.add_argument("--queue-size", type=int, default=pipeline.DEFAULT_QUEUE_SIZE,
+                        metavar="BATCHES",
+                        help="with --pipeline, the number of batches of "
+                             f"{pipeline.BATCH_SIZE} parsed entries the parser may be ahead "
+                             f"of rendering (default: {pipeline.DEFAULT_QUEUE_SIZE})")
+
+    parsed_arguments = parser.parse_args(arguments)
+    if (parsed_arguments.batch or parsed_arguments.watch) and parsed_arguments.file is None:
+        parser.error("--batch and --watch need a directory or glob pattern")
+    if parsed_arguments.pages_per_part is not None:
+        if parsed_arguments.pages_per_part < 1:
+            parser.error("--pages-per-part needs at least one page")
+        if parsed_arguments.cache:
+            parser.error("--pages-per-part can't be combined with --cache")
+    if parsed_arguments.queue_size < 1:
+        parser.error("--queue-size needs at least one batch")
+    if parsed_arguments.fragment_cache:
+        # the caches are only loaded and saved by this process, other processes can't use them
+        if parsed_arguments.workers > 1 and not (parsed_arguments.batch or parsed_arguments.watch):
+            parser.error("--fragment-cache can't be combined with --workers, except for batches")
+        if parsed_arguments.pipeline and parsed_arguments.pipeline_mode == "process":
+            parser.error("--fragment-cache needs --pipeline-mode thread with --pipeline")
+    try:
+        selection = get_selection(parsed_arguments)
+    except ValueError as error:
+        parser.error(str(error))
+    if selection is not None and parsed_arguments.cache:
+        parser.error("selections can't be combined with --cache")
+    return parsed_arguments
+
+
+def get_selection(arguments: argparse.Namespace) -> card_filter.CardFilter:
+    """Get the filter for the selected cards, or None if all cards are created."""
+    selection = card_filter.CardFilter(arguments.keys, arguments.assignee, arguments.priority,
+                                       arguments.ranks)
+    return None if selection.is_empty() else selection
+
+
+def get_file_paths(file_path: str = None) -> (str, str):
     """Get input and output paths needed for generation."""
-    if len(sys.argv) > 1:
-        file_path = sys.argv[1]
-    else:
+    if file_path is None:
         import tkinter.filedialog as file_dialog
         initialize_tkinter()
         file_path = file_dialog.askopenfilename()
 
-    output_path = file_path[:-3] + "pdf"
-    return file_path, output_path
+    return file_path, get_output_path(file_path)
+
+
+def get_output_path(file_path: str) -> str:
+    """Get the path of the pdf created for the given export, right next to it."""
+    return os.path.splitext(file_path)[0] + ".pdf"
+
+
+def generate_cards(file_path: str, output_path: str, arguments: argparse.Namespace) -> list[str]:
+    """Create the pdf for one xml file with the given command line options. Returns the paths
+    of the created files, which are several parts with --pages-per-part."""
+    # reportlab takes a while to load, so it is only imported once cards are actually rendered
+    import card_generator
+
+    if arguments.profile:
+        profiling.enable()
+    selection = get_selection(arguments)
+    if selection is not None:
+        # a reprint of some cards doesn't replace the pdf of all cards
+        output_path = output_path[:-4] + "_selection.pdf"
+    if arguments.pipeline:
+        entries = pipeline.iter_pipelined(iter_entries, (file_path, selection, arguments.index),
+                                          arguments.pipeline_mode, arguments.queue_size)
+    else:
+        entries = iter_entries(file_path, selection, arguments.index)
+
+    layout = card_layout.Layout(arguments.cards_per_page, arguments.paper, arguments.duplex)
+    creator = card_generator.Generator(layout, not arguments.no_compress)
+    fragment_caches = [SANITIZED_STRINGS, creator.paragraphs]
+    if arguments.fragment_cache:
+        SANITIZED_STRINGS.resize(MAX_SANITIZED_BYTES)
+        creator.paragraphs.resize(card_generator.MAX_PARAGRAPH_BYTES)
+        fragment_cache.load(arguments.fragment_cache, fragment_caches,
+                            card_generator.FRAGMENT_VERSION)
+
+    output_paths = [output_path]
+    if arguments.cache:
+        cache = card_cache.CardCache(arguments.cache, arguments.cache_size * 1024 * 1024)
+        delta_path = output_path[:-4] + "_changes.pdf" if arguments.delta else None
+        creator.create_pdf_cached(entries, output_path, cache, delta_path, arguments.workers)
+    elif arguments.pages_per_part is not None:
+        output_paths = creator.create_pdf_parts(entries, output_path, arguments.pages_per_part)
+    elif arguments.workers > 1:
+        creator.create_pdf_parallel(entries, output_path, arguments.workers)
+    else:
+        creator.create_pdf(entries, output_path)
+
+    if arguments.fragment_cache:
+        fragment_cache.save(arguments.fragment_cache, fragment_caches,
+                            card_generator.FRAGMENT_VERSION)
+        # the values are in the file now, they aren't kept for exports without the option
+        SANITIZED_STRINGS.resize(0)
+    if arguments.profile:
+        profiling.write_report(output_path[:-4] + PROFILE_SUFFIX, creator.get_output_report())
+        profiling.disable()
+    return output_paths
+
+
+def find_input_files(pattern: str) -> list[str]:
+    """Get all xml files in a directory, or all files matching a glob pattern. Profiles and
+    indexes written by this tool are left out."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.xml")
+    return sorted(file_path for file_path in glob.glob(pattern)
+                  if not file_path.endswith(OWN_FILE_SUFFIXES))
+
+
+def generate_cards_for_batch_file(file_path: str, arguments: argparse.Namespace) -> str:
+    """Create the pdf for one file of a batch. Errors are reported without stopping the batch,
+    the path of the created pdf (the first part with --pages-per-part) is returned, or None if
+    generation failed."""
+    file_arguments = argparse.Namespace(**vars(arguments))
+    # the batch is already spread over processes, so each file is rendered by one process
+    file_arguments.workers = 1
+    if arguments.cache:
+        # every export gets its own cache, so colors and changed cards are tracked per export
+        file_arguments.cache = os.path.join(arguments.cache, os.path.basename(file_path))
+
+    try:
+        output_paths = generate_cards(file_path, get_output_path(file_path), file_arguments)
+    except Exception as error:
+        # any error of one export, e.g. an item without a summary, must not stop the batch or
+        # the watch process
+        print(f"Could not create cards for {file_path}: {error}", file=sys.stderr)
+        return None
+
+    print(f"Created {', '.join(output_paths)}")
+    return output_paths[0] if output_paths else None
+
+
+def generate_batch(file_paths: list[str], arguments: argparse.Namespace,
+                   executor: concurrent.futures.Executor = None) -> list[str]:
+    """Create pdfs for all files, using the executor's processes if one is given. Returns the
+    created pdf paths in the order of the files, None for files that failed."""
+    if executor is None:
+        return [generate_cards_for_batch_file(file_path, arguments) for file_path in file_paths]
+    return list(executor.map(generate_cards_for_batch_file, file_paths,
+                             [arguments] * len(file_paths)))
+
+
+def get_changed_files(pattern: str, rendered_files: dict[str, float]) -> dict[str, float]:
+    """Get the files matching the pattern that changed since they were last rendered, together
+    with their current modification time."""
+    changed_files = {}
+    for file_path in find_input_files(pattern):
+        try:
+            modification_time = os.path.getmtime(file_path)
+        except OSError:
+            # the file was removed after it was found
+            continue
+        if rendered_files.get(file_path) != modification_time:
+            changed_files[file_path] = modification_time
+    return changed_files
+
+
+def get_up_to_date_files(pattern: str) -> dict[str, float]:
+    """Get all files matching the pattern whose pdf is newer than the file itself."""
+    up_to_date_files = {}
+    for file_path in find_input_files(pattern):
+        output_path = get_output_path(file_path)
+        modification_time = os.path.getmtime(file_path)
+        if os.path.exists(output_path) and os.path.getmtime(output_path) >= modification_time:
+            up_to_date_files[file_path] = modification_time
+    return up_to_date_files
+
+
+def watch(pattern: str, arguments: argparse.Namespace):
+    """Keep creating pdfs for changed files until interrupted. Files whose pdf is already newer
+    are skipped at startup, all others are rendered right away."""
+    rendered_files = get_up_to_date_files(pattern)
+    executor = None
+    if arguments.workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=arguments.workers)
+
+    print(f"Watching {pattern}, press Ctrl+C to stop")
+    try:
+        while True:
+            changed_files = get_changed_files(pattern, rendered_files)
+            generate_batch(list(changed_files), arguments, executor)
+            # failed files are remembered as well, they are tried again once they change
+            rendered_files.update(changed_files)
+
+            time.sleep(arguments.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def print_summary(file_path: str, selection: card_filter.CardFilter = None):
+    """Print how many cards an export would create, for dry runs."""
+    cards_per_assignee = summarize_export(file_path, selection)
+    print(f"{file_path}: {sum(cards_per_assignee.values())} cards")
+    for assignee, card_count in cards_per_assignee.most_common():
+        print(f"    {assignee}: {card_count}")
 
 
 def main():
     """Start card generation."""
-    file_path, output_path = get_file_paths()
-    xml_tree = elementTree.parse(file_path)
-    entries = get_entries_from_xml(xml_tree)
-
-    creator = card_generator.Generator()
-    creator.create_pdf(entries, output_path)
-    open_output_file(output_path)
+    arguments = parse_arguments()
+
+    if arguments.dry_run:
+        file_paths = find_input_files(arguments.file) if arguments.batch or arguments.watch \
+            else [get_file_paths(arguments.file)[0]]
+        for file_path in file_paths:
+            print_summary(file_path, get_selection(arguments))
+    elif arguments.watch:
+        watch(arguments.file, arguments)
+    elif arguments.batch:
+        file_paths = find_input_files(arguments.file)
+        if arguments.workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+                generate_batch(file_paths, arguments, executor)
+        else:
+            generate_batch(file_paths, arguments)
+    else:
+        file_path, output_path = get_file_paths(arguments.file)
+        output_paths = generate_cards(file_path, output_path, arguments)
+        if not arguments.no_open and output_paths:
+            open_output_file(output_paths[0])
 
 
 if __name__ == '__main__':